@@ -0,0 +1,173 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import array, threading
+
+import cache, sqlutil
+
+class InstanceSet(object):
+
+    """
+    Bitmap of the instanceIds a set of roles may see, along with the
+    change marker (see repquery.getChangeMarker) it was built at. Sets are
+    never changed once built, so they can be shared between threads.
+    """
+
+    def __init__(self, instanceIds, marker, bits = None):
+        self.marker = marker
+        instanceIds = list(instanceIds)
+        if instanceIds:
+            size = (max(instanceIds) >> 3) + 1
+        else:
+            size = 0
+
+        if bits is None:
+            self.bits = array.array('B', [ 0 ]) * size
+        else:
+            self.bits = bits[:]
+            if size > len(bits):
+                self.bits.extend([ 0 ] * (size - len(bits)))
+
+        for instanceId in instanceIds:
+            self.bits[instanceId >> 3] |= 1 << (instanceId & 7)
+
+    def __contains__(self, instanceId):
+        byte = instanceId >> 3
+        return (byte < len(self.bits) and
+                (self.bits[byte] & (1 << (instanceId & 7))) != 0)
+
+    def extend(self, instanceIds, marker):
+        """
+        Returns a new set with instanceIds added.
+        """
+        return InstanceSet(instanceIds, marker, bits = self.bits)
+
+    def filter(self, instanceIds):
+        return [ x for x in instanceIds if x in self ]
+
+    def size(self):
+        return len(self.bits)
+
+def _maxInstanceId(marker):
+    try:
+        return int(marker[0])
+    except (TypeError, ValueError):
+        # empty repository
+        return 0
+
+class AccessCache(object):
+
+    """
+    InstanceSets for the role sets seen recently, so permission checks on
+    individual troves don't need to join against UserGroupInstancesCache.
+    The total size of the bitmaps is kept under maxSize bytes.
+
+    Markers are the (newest instanceId, newest Instances change, newest
+    UserGroups change) tuples from repquery.getChangeMarker. Sets are built
+    the first time they're needed. After ordinary commits only the new
+    instances are read and added; the whole set is read again when
+    permissions change, or when any existing instance changed since the
+    set was built (removals and the like). Only one thread reads the rows
+    for a given role set at a time.
+    """
+
+    def __init__(self, maxSize = 64 * 1024 * 1024):
+        self._cache = cache.LRUCache(maxSize, sizeFunc = lambda x: x.size())
+        self._lock = threading.Lock()
+        self._keyLocks = {}
+
+    def _keyLock(self, key):
+        self._lock.acquire()
+        try:
+            lock = self._keyLocks.get(key)
+            if lock is None:
+                lock = self._keyLocks[key] = [ threading.Lock(), 0 ]
+            lock[1] += 1
+            return lock
+        finally:
+            self._lock.release()
+
+    def _releaseKeyLock(self, key, lock):
+        self._lock.acquire()
+        try:
+            lock[1] -= 1
+            if not lock[1]:
+                del self._keyLocks[key]
+        finally:
+            self._lock.release()
+
+    def get(self, cu, roleIds, marker):
+        key = frozenset(roleIds)
+        instances = self._cache.get(key)
+        if instances is not None and instances.marker == marker:
+            return instances
+
+        lock = self._keyLock(key)
+        lock[0].acquire()
+        try:
+            # another thread may have done the work while we waited
+            instances = self._cache.get(key)
+            if instances is None or instances.marker != marker:
+                instances = self._update(cu, roleIds, instances, marker)
+                self._cache.set(key, instances)
+        finally:
+            lock[0].release()
+            self._releaseKeyLock(key, lock)
+
+        return instances
+
+    def _update(self, cu, roleIds, instances, marker):
+        roleList, roleArgs = sqlutil.bindList(roleIds)
+        sql = """
+                SELECT DISTINCT instanceId FROM UserGroupInstancesCache
+                    WHERE userGroupId IN (%s)
+        """ % roleList
+
+        if instances is not None and instances.marker[2] == marker[2]:
+            lastId = _maxInstanceId(instances.marker)
+            if (_maxInstanceId(marker) > lastId and
+                    not self._changedSince(cu, lastId, instances.marker)):
+                # just commits; read the instances added since
+                cu.execute(sql + " AND instanceId > ?",
+                           *(roleArgs + [ lastId ]))
+                return instances.extend((x[0] for x in cu), marker)
+
+        cu.execute(sql, *roleArgs)
+        return InstanceSet((x[0] for x in cu), marker)
+
+    @staticmethod
+    def _changedSince(cu, lastId, marker):
+        # instances which were already in the set may have been removed
+        # (or had their permissions recomputed) alongside a commit
+        if not lastId:
+            return False
+
+        cu.execute("""
+                SELECT 1 FROM Instances
+                    WHERE instanceId <= ? AND changed > ?
+                    LIMIT 1
+        """, lastId, marker[1])
+        return cu.fetchone() is not None
+
+    def invalidate(self, roleIds = None):
+        """
+        Drops the set for roleIds, or all of them if roleIds is None.
+        """
+        if roleIds is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(frozenset(roleIds))
@@ -0,0 +1,187 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import threading, time
+
+# positions in the linked list entries
+_PREV, _NEXT, _KEY, _VALUE, _SIZE = range(5)
+
+class LRUCache(object):
+
+    """
+    Cache which discards the least recently used entries once the total
+    size of its entries exceeds maxSize. The size of an entry is given by
+    sizeFunc(value); without a sizeFunc every entry has a size of one, so
+    maxSize is the number of entries. The cache is safe to share between
+    threads.
+    """
+
+    def __init__(self, maxSize, sizeFunc = None):
+        self.maxSize = maxSize
+        self.sizeFunc = sizeFunc
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._map = {}
+        # circular doubly linked list; the entry after _root is the most
+        # recently used one
+        self._root = []
+        self._root[:] = [ self._root, self._root, None, None, 0 ]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def _unlink(self, entry):
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _linkFront(self, entry):
+        root = self._root
+        entry[_PREV] = root
+        entry[_NEXT] = root[_NEXT]
+        root[_NEXT][_PREV] = entry
+        root[_NEXT] = entry
+
+    def _remove(self, entry):
+        self._unlink(entry)
+        del self._map[entry[_KEY]]
+        self.size -= entry[_SIZE]
+
+    def get(self, key, default = None):
+        self._lock.acquire()
+        try:
+            entry = self._map.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._unlink(entry)
+            self._linkFront(entry)
+            return entry[_VALUE]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        if self.sizeFunc is None:
+            size = 1
+        else:
+            size = self.sizeFunc(value)
+
+        self._lock.acquire()
+        try:
+            entry = self._map.get(key)
+            if entry is not None:
+                self._remove(entry)
+
+            if size > self.maxSize:
+                # this would push everything else out
+                return
+
+            entry = [ None, None, key, value, size ]
+            self._linkFront(entry)
+            self._map[key] = entry
+            self.size += size
+
+            while self.size > self.maxSize:
+                self._remove(self._root[_PREV])
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def pop(self, key, default = None):
+        self._lock.acquire()
+        try:
+            entry = self._map.get(key)
+            if entry is None:
+                return default
+
+            self._remove(entry)
+            return entry[_VALUE]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map.clear()
+            self._root[:] = [ self._root, self._root, None, None, 0 ]
+            self.size = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return { 'entries' : len(self._map), 'size' : self.size,
+                 'maxSize' : self.maxSize, 'hits' : self.hits,
+                 'misses' : self.misses, 'evictions' : self.evictions }
+
+class TTLCache(LRUCache):
+
+    """
+    LRUCache whose entries also expire ttl seconds after they are set.
+    """
+
+    def __init__(self, maxSize, ttl, sizeFunc = None, timeFunc = time.time):
+        if sizeFunc is not None:
+            valueSize = sizeFunc
+            sizeFunc = lambda x: valueSize(x[1])
+
+        LRUCache.__init__(self, maxSize, sizeFunc = sizeFunc)
+        self.ttl = ttl
+        self.timeFunc = timeFunc
+        self.expirations = 0
+
+    def get(self, key, default = None):
+        self._lock.acquire()
+        try:
+            entry = self._map.get(key)
+            if entry is not None and entry[_VALUE][0] <= self.timeFunc():
+                self._remove(entry)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._unlink(entry)
+            self._linkFront(entry)
+            return entry[_VALUE][1]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        LRUCache.set(self, key, (self.timeFunc() + self.ttl, value))
+
+    def pop(self, key, default = None):
+        entry = LRUCache.pop(self, key)
+        if entry is None:
+            return default
+
+        return entry[1]
+
+    def stats(self):
+        d = LRUCache.stats(self)
+        d['expirations'] = self.expirations
+        return d
@@ -23,17 +23,36 @@ from conary import versions
 class BaseObject(object):
 
     def __init__(self, **kwargs):
-        for key, val in self.__class__.__dict__.iteritems():
-            if type(val) == list:
-                setattr(self, key, [])
-
-        for key, val in kwargs.iteritems():
-            if (hasattr(self.__class__, key) or
-                (hasattr(self, '_xobj') and key in (self._xobj.attributes))):
-                setattr(self, key, val)
-            else:
+        listFields, allowed = self._getFields()
+        d = self.__dict__
+        for key in listFields:
+            d[key] = []
+
+        for key in kwargs:
+            if key not in allowed:
                 raise TypeError, 'unknown constructor parameter %s' % key
 
+        d.update(kwargs)
+
+    @classmethod
+    def _getFields(cls):
+        # (list fields, allowed constructor parameters) for cls. these are
+        # worked out the first time cls is instantiated and kept in the
+        # class itself; looking in cls.__dict__ keeps subclasses from
+        # picking up their parent's table
+        fields = cls.__dict__.get('_fields')
+        if fields is None:
+            listFields = tuple(key for key, val in cls.__dict__.iteritems()
+                                    if type(val) == list)
+            allowed = set(dir(cls))
+            if hasattr(cls, '_xobj'):
+                allowed.update(cls._xobj.attributes)
+
+            fields = (listFields, frozenset(allowed))
+            cls._fields = fields
+
+        return fields
+
 class VersionSummary(BaseObject):
 
     revision = str
@@ -79,7 +98,7 @@ class TroveIdent(BaseObject):
 class TroveIdentList(BaseObject):
 
     _xobj = xobj.XObjMetadata(attributes = { 'total' : int, 'start' : int,
-                                             'id' : str } )
+                                             'id' : str, 'next' : str } )
     trove = [ TroveIdent ]
 
     def append(self, name = None, version = None, flavor = None, mkUrl = None):
@@ -110,17 +129,33 @@ class FileReference(BaseObject):
 
     def __init__(self, mkUrl = None, fileId = None, version = None,
                  thisHost = None, path = None, pathId = None,
-                 contentAvailable = None, **kwargs):
+                 contentAvailable = None, host = None, **kwargs):
         BaseObject.__init__(self, fileId = fileId, version = version,
                             pathId = pathId, path = path, **kwargs)
         if mkUrl:
-            host = versions.VersionFromString(version).trailingLabel().getHost()
+            if host is None:
+                host = versions.VersionFromString(
+                                version).trailingLabel().getHost()
             flags = [ ( 'path', os.path.basename(path)) ]
             if not contentAvailable:
                 flags.append(( 'nocontent', '1'))
             self.inode = Inode(id = mkUrl('file', self.fileId, 'info',
                                flags, host = host))
 
+class FileList(BaseObject):
+
+    _xobj = xobj.XObjMetadata(attributes = { 'total' : int, 'start' : int,
+                                             'id' : str, 'next' : str },
+                              tag = 'filelist')
+    fileref = [ FileReference ]
+
+    def addFile(self, f):
+        self.fileref.append(f)
+
+class FileListRef(BaseObject):
+
+    _xobj = xobj.XObjMetadata(attributes = { 'id' : str })
+
 class ListOfTroves(BaseObject):
 
     displayname = str
@@ -197,6 +232,7 @@ class SingleTrove(TroveIdent):
     buildlog = str
     xmlbuildlog = BuildLog
     buildlog = BuildLog
+    filelist = FileListRef
 
     def __init__(self, source = None, mkUrl = None, thisHost = None, **kwargs):
         TroveIdent.__init__(self, mkUrl = mkUrl, **kwargs)
@@ -210,6 +246,13 @@ class SingleTrove(TroveIdent):
     def addFile(self, f):
         self.fileref.append(f)
 
+    def setFileList(self, host):
+        # the files are left out of the document; link to them instead
+        self.filelist = FileListRef(id = self._mkUrl('trove',
+                                "%s=%s[%s]" % (self.name, self.version.full,
+                                               self.flavor),
+                                'files', host = host))
+
     def addReferencedTrove(self, name, version, flavor, mkUrl = None):
         if self.included == IncludedTroves:
             self.included = IncludedTroves()
@@ -285,7 +328,7 @@ Node.fulltrovelist = NodeList           # circular type reference
 class NamedNodeList(NodeList):
     _xobj = xobj.XObjMetadata(tag = 'nodelist',
                               attributes = { 'total' : int, 'start' : int,
-                                             'id' : str })
+                                             'id' : str, 'next' : str })
     node = [ Node ]
 
 class Label(BaseObject):
@@ -363,6 +406,21 @@ class BlockDeviceFile(_DeviceFile):
 class CharacterDeviceFile(_DeviceFile):
     _xobj = xobj.XObjMetadata(attributes = { 'id' : str }, tag = 'chardevice')
 
+class FileInfoList(BaseObject):
+
+    _xobj = xobj.XObjMetadata(tag = 'fileinfolist')
+    file = [ RegularFile ]
+    directory = [ Directory ]
+    symlink = [ SymlinkFile ]
+    socket = [ Socket ]
+    namedpipe = [ NamedPipe ]
+    blockdevice = [ BlockDeviceFile ]
+    chardevice = [ CharacterDeviceFile ]
+
+    def append(self, f):
+        # each kind of file has its own element name
+        getattr(self, f._xobj.tag).append(f)
+
 class Repository(BaseObject):
 
     _xobj = xobj.XObjMetadata(attributes = { 'id' : str }, tag = 'repository')
@@ -0,0 +1,257 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import threading, time
+
+class PoolTimeout(Exception):
+
+    pass
+
+class ConnectionPool(object):
+
+    """
+    Database connections shared by the threads of a server, so concurrent
+    requests neither serialize on one handle nor reconnect every time.
+
+    A thread checks a connection out for the length of a request; checking
+    out again from the same thread returns the same connection, and it goes
+    back to the pool when every checkout has been checked in. At most
+    maxSize connections are open at once; checkout() waits up to timeout
+    seconds for one to be returned before raising PoolTimeout.
+    Connections which have sat unused for maxIdle seconds are closed, and
+    ones which have been idle for more than checkInterval seconds are
+    tested with a trivial query before being handed out again.
+
+    This is meant for client/server databases; sqlite handles can't be
+    passed between threads.
+    """
+
+    healthQuery = 'SELECT 1'
+
+    def __init__(self, connect, maxSize = 8, maxIdle = 300,
+                 checkInterval = 30, timeout = 30, timeFunc = time.time):
+        # connect() returns a new dbstore database
+        self.connect = connect
+        self.maxSize = maxSize
+        self.maxIdle = maxIdle
+        self.checkInterval = checkInterval
+        self.timeout = timeout
+        self.timeFunc = timeFunc
+        self._cond = threading.Condition()
+        # (lastUsed, db), most recently used last
+        self._idle = []
+        self._open = 0
+        self._local = threading.local()
+        self._stats = dict(connects = 0, checkouts = 0, waits = 0,
+                           recycled = 0, failedChecks = 0)
+
+    @classmethod
+    def fromDatabase(cls, db, **kwargs):
+        """
+        Returns a pool of connections to the same database as the dbstore
+        database db.
+        """
+        from conary import dbstore
+
+        database, driver = db.database, db.driver
+        return cls(lambda: dbstore.connect(database, driver = driver),
+                   **kwargs)
+
+    def checkout(self):
+        held = getattr(self._local, 'held', None)
+        if held is not None:
+            self._local.count += 1
+            return held
+
+        while True:
+            lastUsed, db = self._get()
+            if db is None:
+                try:
+                    db = self.connect()
+                except:
+                    self._discard(None)
+                    raise
+                self._count('connects')
+            elif (self.timeFunc() - lastUsed > self.checkInterval and
+                        not self._healthy(db)):
+                self._count('failedChecks')
+                self._discard(db)
+                continue
+
+            break
+
+        self._local.held = db
+        self._local.count = 1
+        return db
+
+    def checkin(self, db):
+        """
+        Returns db to the pool. Any open transaction should have been
+        committed or rolled back first.
+        """
+        if getattr(self._local, 'held', None) is not db:
+            # detached
+            self._put(db)
+            return
+
+        self._local.count -= 1
+        if self._local.count:
+            return
+
+        self._local.held = None
+        self._put(db)
+
+    def detach(self, db):
+        """
+        Releases the current thread's hold on db without returning it to
+        the pool; whoever finishes with it must call checkin(). Used when a
+        response keeps reading from the database after the request
+        handler returns.
+        """
+        if getattr(self._local, 'held', None) is db:
+            self._local.held = None
+
+    def discard(self, db):
+        """
+        Closes a checked out connection which is no longer usable instead
+        of returning it to the pool.
+        """
+        if getattr(self._local, 'held', None) is db:
+            self._local.held = None
+        self._discard(db)
+
+    def close(self):
+        """
+        Closes the idle connections. Ones which are checked out are closed
+        when they're returned.
+        """
+        self._cond.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+            self._open -= len(idle)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+        for lastUsed, db in idle:
+            self._close(db)
+
+    def stats(self):
+        self._cond.acquire()
+        try:
+            d = dict(self._stats)
+            d['open'] = self._open
+            d['idle'] = len(self._idle)
+            return d
+        finally:
+            self._cond.release()
+
+    def _get(self):
+        # returns (lastUsed, db) for an idle connection, or (None, None) if
+        # a new one should be opened
+        now = self.timeFunc()
+        deadline = now + self.timeout
+        self._cond.acquire()
+        try:
+            stale = self._expire(now)
+            waited = False
+            while not self._idle and self._open >= self.maxSize:
+                remaining = deadline - self.timeFunc()
+                if remaining <= 0:
+                    raise PoolTimeout('no database connection available '
+                                      'after %d seconds' % self.timeout)
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                self._cond.wait(remaining)
+
+            self._stats['checkouts'] += 1
+            if self._idle:
+                result = self._idle.pop()
+            else:
+                self._open += 1
+                result = (None, None)
+        finally:
+            self._cond.release()
+
+        for db in stale:
+            self._close(db)
+
+        return result
+
+    def _put(self, db):
+        now = self.timeFunc()
+        self._cond.acquire()
+        try:
+            self._idle.append((now, db))
+            stale = self._expire(now)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+        for db in stale:
+            self._close(db)
+
+    def _expire(self, now):
+        # removes connections idle for more than maxIdle seconds from the
+        # pool and returns them; called with the lock held
+        stale = [ x[1] for x in self._idle if now - x[0] > self.maxIdle ]
+        if stale:
+            self._idle = [ x for x in self._idle
+                                if now - x[0] <= self.maxIdle ]
+            self._open -= len(stale)
+            self._stats['recycled'] += len(stale)
+            self._cond.notifyAll()
+
+        return stale
+
+    def _discard(self, db):
+        self._cond.acquire()
+        try:
+            self._open -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+        if db is not None:
+            self._close(db)
+
+    def _count(self, name):
+        self._cond.acquire()
+        try:
+            self._stats[name] += 1
+        finally:
+            self._cond.release()
+
+    def _healthy(self, db):
+        try:
+            cu = db.cursor()
+            cu.execute(self.healthQuery)
+            cu.fetchall()
+            if db.inTransaction(default = False):
+                db.rollback()
+        except Exception:
+            return False
+
+        return True
+
+    def _close(self, db):
+        try:
+            db.close()
+        except Exception:
+            pass
@@ -0,0 +1,94 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Indexes crest adds to the repository schema. They only speed up crest's
+queries; conary doesn't use them. The server never creates them itself,
+since building an index on a live repository can block commits for a long
+time. An administrator adds them once, either with
+
+    python -m crest.indexes --config /srv/conary/repository.cnr
+
+or, on PostgreSQL, by running the statements printed by
+
+    python -m crest.indexes --sql
+
+through psql, which builds them without locking out writers.
+"""
+
+import optparse, sys
+
+# (table, index name, columns)
+CREST_INDEXES = [
+    ( 'Nodes', 'CrestNodesItemFinalTsIdx', 'itemId, finalTimestamp' ),
+    # nothing is added to TroveFiles, the largest table in a repository.
+    # repquery.getBuildLogs finds its rows through conary's own filePathId
+    # index; each build log path only has a few rows to check against the
+    # instanceIds
+]
+
+def indexSql():
+    """
+    Returns the PostgreSQL statements which create the indexes.
+    """
+    return [ "CREATE INDEX CONCURRENTLY %s ON %s (%s);" % (name, table,
+                                                          columns)
+             for (table, name, columns) in CREST_INDEXES ]
+
+def createIndexes(db):
+    """
+    Creates the indexes which don't exist yet in db. Returns the names of
+    the ones which were created.
+    """
+    db.loadSchema()
+    created = []
+    for (table, name, columns) in CREST_INDEXES:
+        if db.createIndex(table, name, columns):
+            created.append(name)
+
+    if created:
+        db.commit()
+
+    return created
+
+def main(argv = sys.argv[1:]):
+    parser = optparse.OptionParser(usage = '%prog --config FILE | --sql')
+    parser.add_option('--config', help = 'repository server configuration')
+    parser.add_option('--sql', action = 'store_true', default = False,
+                      help = 'print the SQL instead of running it')
+    options, args = parser.parse_args(argv)
+    if args or not (options.config or options.sql):
+        parser.error('--config or --sql is required')
+
+    if options.sql:
+        for stmt in indexSql():
+            print stmt
+        return 0
+
+    from conary import dbstore
+    from conary.repository.netrepos import netserver
+
+    cfg = netserver.ServerConfig()
+    cfg.read(options.config)
+    driver, path = cfg.repositoryDB
+    db = dbstore.connect(path, driver = driver)
+    for name in createIndexes(db):
+        print 'created %s' % name
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
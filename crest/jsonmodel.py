@@ -0,0 +1,73 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# Serializes datamodel objects as JSON. The structure follows the XML xobj
+# generates for the same objects: each object becomes a dictionary of its
+# public attributes and elements, and the document is wrapped in a
+# dictionary keyed by the object's tag. Unlike XML, lists are always
+# arrays, even when they have a single member.
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+_scalarTypes = set([ str, unicode, int, long, float, bool ])
+
+def toData(obj):
+    """
+    Returns obj as a tree of dictionaries, lists and scalars.
+    """
+    if type(obj) in _scalarTypes:
+        return obj
+
+    if isinstance(obj, list):
+        return [ toData(x) for x in obj ]
+
+    if isinstance(obj, (basestring, int, long, float)):
+        # subclasses of the scalar types, such as datamodel.XObjLong
+        return obj
+
+    d = {}
+    for key, val in obj.__dict__.iteritems():
+        if key[0] == '_' or val is None or isinstance(val, type):
+            continue
+
+        d[key] = toData(val)
+
+    return d
+
+def tagName(obj):
+    xobjMeta = getattr(obj, '_xobj', None)
+    tag = getattr(xobjMeta, 'tag', None)
+    if tag:
+        return tag
+
+    return obj.__class__.__name__.lower()
+
+def toJSON(obj, tag = None):
+    """
+    Returns the JSON document for obj. The document's only key is tag,
+    which defaults to the tag xobj would use for obj's element.
+    """
+    if tag is None:
+        tag = tagName(obj)
+
+    return json.dumps({ tag : toData(obj) }, separators = (',', ':'))
+
+def dumps(data):
+    return json.dumps(data, separators = (',', ':'))
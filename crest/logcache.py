@@ -0,0 +1,186 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import errno, os, tempfile, threading, time
+
+from conary.lib import util
+
+class LogCache(object):
+
+    """
+    Directory of build logs (or file contents) which have already been
+    transcoded, named by the sha1 of the stored file. Once the total size of
+    the files passes maxSize the least recently used ones (by mtime, which
+    is updated on every hit) are removed. Several processes may share the
+    directory; files only appear in it through an atomic rename.
+
+    The directory is only scanned when this process's running estimate of
+    its size passes maxSize, so entries added by other processes are
+    noticed late. Temporary files left behind by writers which died are
+    counted while they're recent and removed once they're older than
+    maxTempAge seconds.
+    """
+
+    # the largest share of the cache a single entry may take
+    maxEntryFraction = 16
+    maxTempAge = 3600
+
+    def __init__(self, path, maxSize = 256 * 1024 * 1024, suffix = '.gz'):
+        self.path = path
+        self.maxSize = maxSize
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        # size of the directory as of the last scan plus what has been
+        # added since; None until the first scan
+        self._size = None
+
+    def _path(self, sha1):
+        return os.path.join(self.path, sha1 + self.suffix)
+
+    def fits(self, size):
+        """
+        Returns whether an entry of about size bytes is small enough to be
+        worth caching. Larger ones would evict most of the cache.
+        """
+        return size <= self.maxSize / self.maxEntryFraction
+
+    def lookup(self, sha1):
+        """
+        Returns the path to the cached copy of the log sha1, or None if
+        there isn't one.
+        """
+        path = self._path(sha1)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+
+        return path
+
+    def writer(self, sha1):
+        """
+        Returns a CacheWriter for adding the log sha1 to the cache.
+        """
+        fd, tmpPath = tempfile.mkstemp(dir = self.path, prefix = '.tmp-')
+        return CacheWriter(self, os.fdopen(fd, 'w'), tmpPath,
+                           self._path(sha1))
+
+    def added(self, size):
+        """
+        Notes that an entry of size bytes was added, pruning the cache if
+        it may now be too big.
+        """
+        self._lock.acquire()
+        try:
+            if self._size is not None and self._size + size <= self.maxSize:
+                self._size += size
+                return
+        finally:
+            self._lock.release()
+
+        self.prune()
+
+    def prune(self):
+        self._lock.acquire()
+        try:
+            entries = []
+            total = 0
+            oldTemp = time.time() - self.maxTempAge
+            for name in os.listdir(self.path):
+                if name.startswith('.') and not name.startswith('.tmp-'):
+                    continue
+
+                path = os.path.join(self.path, name)
+                try:
+                    sb = os.stat(path)
+                except OSError:
+                    # another process removed it
+                    continue
+
+                if name.startswith('.tmp-'):
+                    if sb.st_mtime >= oldTemp:
+                        # still being written
+                        total += sb.st_size
+                        continue
+
+                    try:
+                        os.unlink(path)
+                    except OSError, e:
+                        if e.errno != errno.ENOENT:
+                            raise
+                    continue
+
+                entries.append((sb.st_mtime, sb.st_size, name))
+                total += sb.st_size
+
+            entries.sort()
+            while total > self.maxSize and entries:
+                mtime, size, name = entries.pop(0)
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                total -= size
+
+            self._size = total
+        finally:
+            self._lock.release()
+
+class CacheWriter(object):
+
+    def __init__(self, cache, f, tmpPath, path):
+        self.cache = cache
+        self.f = f
+        self.tmpPath = tmpPath
+        self.path = path
+        self.size = 0
+
+    def write(self, s):
+        self.f.write(s)
+        self.size += len(s)
+
+    def commit(self):
+        self.f.close()
+        os.rename(self.tmpPath, self.path)
+        self.cache.added(self.size)
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.unlink(self.tmpPath)
+        except OSError:
+            pass
+
+_caches = {}
+
+def getLogCache(path, suffix = '.gz'):
+    """
+    Returns the LogCache for directory path, creating the directory if
+    needed. Returns None if the directory can't be used. Suffix is the
+    file name extension for the entries.
+    """
+    cache = _caches.get(path)
+    if cache is None:
+        try:
+            util.mkdirChain(path)
+        except OSError:
+            return None
+
+        cache = _caches.setdefault(path, LogCache(path, suffix = suffix))
+
+    return cache
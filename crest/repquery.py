@@ -15,54 +15,396 @@
 #
 
 
-import itertools, os, re
+import base64, itertools, os, re
 
-import datamodel
+import access, cache, datamodel, sqlutil
 from conary import files, trove, versions
 from conary.deps import deps
 from conary.lib.sha1helper import sha1ToString, md5ToString, sha1FromString
 from conary.server import schema
 
-def typeFilter(l, filterSet):
+# characters which make a name= search parameter a regular expression
+_REGEX_CHARS = set('?.*[]\\()+{}|^$')
+
+_sqliteRegexCache = {}
+
+def _sqliteRegexp(pattern, item):
+    # sqlite implements "X REGEXP Y" as regexp(Y, X); compiled patterns are
+    # kept around since this gets called once per row
+    if item is None:
+        return 0
+
+    regex = _sqliteRegexCache.get(pattern)
+    if regex is None:
+        if len(_sqliteRegexCache) > 100:
+            _sqliteRegexCache.clear()
+        regex = re.compile(pattern)
+        _sqliteRegexCache[pattern] = regex
+
+    return regex.match(item) is not None
+
+# the same few versions and flavors show up on thousands of rows in a
+# listing, so thawed versions and flavor strings are kept for the life of
+# the process. Version objects are never modified after they're thawed, so
+# sharing them between requests is safe
+_versionCache = cache.LRUCache(20000)
+_flavorCache = cache.LRUCache(2000)
+
+def thawVersion(version, timeStamps):
+    """
+    Returns the Version object for version (a version string) and
+    timeStamps (the colon separated timestamps stored along with it).
+    """
+    key = (version, timeStamps)
+    ver = _versionCache.get(key)
+    if ver is None:
+        ver = versions.ThawVersion(
+                versions.strToFrozen(version, timeStamps.split(":")))
+        _versionCache.set(key, ver)
+
+    return ver
+
+def flavorString(frozenFlavor):
+    """
+    Returns the string form of a frozen flavor.
+    """
+    flavor = _flavorCache.get(frozenFlavor)
+    if flavor is None:
+        flavor = str(deps.ThawFlavor(frozenFlavor))
+        _flavorCache.set(frozenFlavor, flavor)
+
+    return flavor
+
+_hostCache = cache.LRUCache(20000)
+
+def versionHost(version):
+    """
+    Returns the host of the trailing label of version (a version string).
+    Every file in a trove comes from one of a few versions, so the answers
+    are cached.
+    """
+    host = _hostCache.get(version)
+    if host is None:
+        host = versions.VersionFromString(version).trailingLabel().getHost()
+        _hostCache.set(version, host)
+
+    return host
+
+def _likeEscape(s):
+    return s.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+def _globEscape(s):
+    return ''.join(x in '*?[' and '[%s]' % x or x for x in s)
+
+def _regexPrefix(regex):
+    """
+    Returns the literal string every item matched by regex must start with
+    (which may be empty). The result is conservative; if the regex has
+    alternation or inline flags no prefix is assumed.
+    """
+    if '|' in regex or '(?' in regex:
+        return ''
+
+    prefix = []
+    for ch in regex:
+        if ch in _REGEX_CHARS:
+            if ch in '?*{' and prefix:
+                # the previous character is optional
+                prefix.pop()
+            break
+
+        prefix.append(ch)
+
+    return ''.join(prefix)
+
+def nameCheck(db, name):
+    """
+    Builds the SQL needed to restrict Items.item to those which match name.
+    Returns (clauses, args, regex). Clauses is a list of SQL conditions
+    which should be ANDed into the query and args the parameters those
+    conditions use. If the database can't evaluate the regular expression
+    itself, regex is a compiled expression which the caller needs to apply
+    to the results; otherwise it is None.
+
+    LIKE is only relied on where it is case sensitive (PostgreSQL). SQLite
+    uses GLOB and REGEXP instead, and elsewhere LIKE just narrows the rows
+    the regular expression is applied to.
+    """
+    if not (_REGEX_CHARS & set(name)):
+        return [ "item = ?" ], [ name ], None
+
+    # this validates the regular expression whether or not we end up
+    # using it ourselves
+    regex = re.compile(name)
+    driver = getattr(db, 'driver', None)
+
+    # if only .* appears, replace them with wildcards. this fails with \.*
+    # in the regex, but neither . nor \* are valid trove names anyway.
+    # regular expressions only anchor at the front, so the pattern always
+    # gets a trailing wildcard
+    pieces = name.split('.*')
+    if not (_REGEX_CHARS & set(''.join(pieces))):
+        if driver == 'sqlite':
+            globName = '*'.join(_globEscape(x) for x in pieces)
+            if pieces[-1]:
+                globName += '*'
+            return [ "item GLOB ?" ], [ globName ], None
+
+        likeName = '%'.join(_likeEscape(x) for x in pieces)
+        if not likeName.endswith('%'):
+            likeName += '%'
+        if driver in ('postgresql', 'pgpool'):
+            regex = None
+        return [ "item LIKE ? ESCAPE '!'" ], [ likeName ], regex
+
+    clauses = []
+    args = []
+
+    # a literal prefix lets the database use the index on Items.item
+    # before it looks at the regex at all
+    prefix = _regexPrefix(name)
+    if prefix and driver == 'sqlite':
+        clauses.append("item GLOB ?")
+        args.append(_globEscape(prefix) + '*')
+    elif prefix:
+        clauses.append("item LIKE ? ESCAPE '!'")
+        args.append(_likeEscape(prefix) + '%')
+
+    if driver in ('postgresql', 'pgpool'):
+        clauses.append("item ~ ?")
+        args.append('^(?:%s)' % name)
+        regex = None
+    elif driver == 'sqlite':
+        db.dbh.create_function('regexp', 2, _sqliteRegexp)
+        clauses.append("item REGEXP ?")
+        args.append(name)
+        regex = None
+
+    return clauses, args, regex
+
+def _caseSensitiveLike(db):
+    # returns the operator which matches a LIKE pattern case sensitively on
+    # db, and the wildcard it uses
+    driver = getattr(db, 'driver', None)
+    if driver == 'sqlite':
+        return 'GLOB', '*'
+    elif driver == 'mysql':
+        return 'LIKE BINARY', '%'
+
+    return 'LIKE', '%'
+
+def typeCheck(filterSet, column = 'item', db = None):
+    """
+    Builds a SQL condition which restricts column (a trove name) to the
+    trove types in filterSet. Returns (condition, args), or (None, []) if
+    no restriction is needed. The conditions mirror the trove.troveIs*()
+    checks (which are case sensitive) so the type filter can be applied by
+    the database before any rows are returned.
+    """
     if not filterSet:
-        return l
+        return None, []
+
+    op, wildcard = _caseSensitiveLike(db)
+    def like(pattern, negate = False):
+        if negate:
+            sql = "%s NOT %s ?" % (column, op)
+        else:
+            sql = "%s %s ?" % (column, op)
+        return sql, [ pattern.replace('%', wildcard) ]
 
-    filters = []
+    def both(first, second):
+        return ("%s AND %s" % (first[0], second[0]), first[1] + second[1])
+
+    isComponent = like('%:%')
+    notComponent = like('%:%', negate = True)
+    # collections include filesets, but groups and packages don't
+    notFileset = both(notComponent, like('fileset-%', negate = True))
+
+    checks = []
     if 'group' in filterSet:
-        filters.append(trove.troveIsGroup)
+        checks.append((notFileset, like('group-%')))
     if 'package' in filterSet:
-        filters.append(trove.troveIsPackage)
+        checks.append((notFileset, like('group-%', negate = True)))
     if 'component' in filterSet:
-        filters.append(trove.troveIsComponent)
+        checks.append((isComponent,))
     if 'fileset' in filterSet:
-        filters.append(trove.troveIsFileSet)
+        checks.append((like('fileset-%'), notComponent))
     if 'collection' in filterSet:
-        filters.append(trove.troveIsCollection)
+        checks.append((notComponent,))
     if 'source' in filterSet:
-        filters.append(trove.troveIsSourceComponent)
+        checks.append((like('%:source'),))
     if 'binarycomponent' in filterSet:
-        filters.append(lambda x: trove.troveIsComponent(x) and
-                                 not trove.troveIsSourceComponent(x))
+        checks.append((isComponent, like('%:source', negate = True)))
 
-    filters.append(None)
+    if not checks:
+        # only unknown types were asked for
+        return "1 = 0", []
 
-    filteredL = []
-    for item in l:
-        if filters:
-            for f in filters:
-                if f and f(item[0]): break
-            if f is None:
+    conditions = []
+    args = []
+    for check in checks:
+        conditions.append("(%s)" % " AND ".join(x[0] for x in check))
+        for x in check:
+            args += x[1]
+
+    return "(%s)" % " OR ".join(conditions), args
+
+def encodeCursor(values):
+    """
+    Returns an opaque continuation token for a row's sort key.
+    """
+    return base64.urlsafe_b64encode("\0".join(values))
+
+def decodeCursor(token, count):
+    """
+    Returns the sort key stored in a continuation token which was built
+    from count values. ValueError is raised for malformed tokens.
+    """
+    try:
+        values = base64.urlsafe_b64decode(str(token)).split("\0")
+    except TypeError:
+        raise ValueError('invalid cursor')
+
+    if len(values) != count:
+        raise ValueError('invalid cursor')
+
+    return values
+
+def seekCheck(columns, values):
+    """
+    Builds a SQL condition which selects the rows sorted after values.
+    Columns is a list of (column, operator) pairs in sort order, where
+    operator is '>' for ascending columns and '<' for descending ones.
+    Returns (condition, args).
+    """
+    (column, op) = columns[0]
+    if len(columns) == 1:
+        return "%s %s ?" % (column, op), [ values[0] ]
+
+    rest, restArgs = seekCheck(columns[1:], values[1:])
+    return ("(%s %s ? OR (%s = ? AND %s))" % (column, op, column, rest),
+            [ values[0], values[0] ] + restArgs)
+
+def setNextPage(pageList, resource, cursor, mkUrl = None, label = None,
+                name = None, latest = True, filterSet = None, limit = None,
+                withTotal = True):
+    """
+    Records that more results follow pageList. The continuation token is
+    kept in pageList._nextCursor, and if mkUrl is given the 'next' attribute
+    becomes a link to the following page of the same search.
+    """
+    pageList._nextCursor = cursor
+    if not mkUrl:
+        return
+
+    nextQuery = []
+    if label:
+        nextQuery.append(('label', label))
+    if name:
+        nextQuery.append(('name', name))
+    if not latest:
+        nextQuery.append(('latest', '0'))
+    for troveType in sorted(filterSet or []):
+        nextQuery.append(('type', troveType))
+    nextQuery.append(('limit', str(limit)))
+    if not withTotal:
+        nextQuery.append(('total', '0'))
+    nextQuery.append(('cursor', cursor))
+    pageList.next = mkUrl(resource, nextQuery)
+
+def iterPages(search, cu, roleIds, batchSize = 1000, start = 0,
+              limit = None, cursor = None, withTotal = True, **kwargs):
+    """
+    Runs search (searchNodes or searchTroves) one batch of batchSize
+    results at a time, following the continuation cursor from one batch to
+    the next, and yields each batch as it is retrieved. Only the first
+    batch reports the total. This lets large results be sent without
+    holding all of them in memory.
+    """
+    while limit is None or limit > 0:
+        if limit is None:
+            pageSize = batchSize
+        else:
+            pageSize = min(batchSize, limit)
+
+        page = search(cu, roleIds, start = start, limit = pageSize,
+                      cursor = cursor, withTotal = withTotal, **kwargs)
+        yield page
+
+        cursor = getattr(page, '_nextCursor', None)
+        if cursor is None:
+            break
+
+        if limit is not None:
+            limit -= pageSize
+        start = 0
+        withTotal = False
+
+_changeLogCache = cache.LRUCache(20000)
+
+# the most (name, version) pairs looked up in one query
+CHANGELOG_BATCH = 256
+
+def getChangeLogs(cu, sources):
+    """
+    Returns a dict mapping each (sourceName, sourceVersion) pair in sources
+    to the (name, message) of the changelog for that source node, or None
+    if it doesn't have one. Pairs without a node are left out. Changelogs
+    never change once they are committed, so they are remembered.
+    """
+    result = {}
+    missing = []
+    for key in set(sources):
+        cl = _changeLogCache.get(key)
+        if cl is None:
+            missing.append(key)
+        else:
+            result[key] = cl[0]
+
+    missing.sort()
+    for i in range(0, len(missing), CHANGELOG_BATCH):
+        batch = missing[i:i + CHANGELOG_BATCH]
+        wanted = set(batch)
+        nameList, nameArgs = sqlutil.bindList(sorted(set(x[0] for x in batch)))
+        versionList, versionArgs = sqlutil.bindList(
+                                        sorted(set(x[1] for x in batch)))
+        # names and versions are matched separately, so this can find
+        # nodes for pairs nobody asked about; those are ignored
+        cu.execute("""
+            SELECT SourceItems.item, SourceVersion.version,
+                   ChangeLogs.name, ChangeLogs.message
+                FROM Items AS SourceItems
+                JOIN Nodes ON SourceItems.itemId = Nodes.itemId
+                JOIN Versions AS SourceVersion ON
+                    Nodes.versionId = SourceVersion.versionId
+                LEFT OUTER JOIN ChangeLogs ON
+                    Nodes.nodeId = ChangeLogs.nodeId
+                WHERE SourceItems.item IN (%s) AND
+                      SourceVersion.version IN (%s)
+        """ % (nameList, versionList), *(nameArgs + versionArgs))
+
+        for (item, version, clName, clMessage) in cu:
+            key = (item, version)
+            if key not in wanted:
                 continue
 
-        filteredL.append(item)
+            if clName:
+                cl = (clName, clMessage)
+            else:
+                cl = None
+
+            # wrapped so a node without a changelog is still a cache hit
+            _changeLogCache.set(key, (cl,))
+            result[key] = cl
 
-    return filteredL
+    return result
 
 def searchNodes(cu, roleIds, label = None, mkUrl = None, filterSet = None,
-                db = None, name = None, latest = 1):
+                db = None, name = None, latest = 1, start = 0, limit = None,
+                cursor = None, withTotal = True):
     args = []
-    d = { 'labelCheck' : '', 'itemCheck' : '' }
-    d['roleIds'] = ",".join( str(x) for x in roleIds)
+    d = { 'labelCheck' : '', 'itemCheck' : '', 'typeCheck' : '',
+          'where' : '', 'distinct' : '' }
     d['SOURCENAME'] = trove._TROVEINFO_TAG_SOURCENAME
     d['METADATA'] = trove._TROVEINFO_TAG_METADATA
 
@@ -74,15 +416,22 @@ def searchNodes(cu, roleIds, label = None, mkUrl = None, filterSet = None,
         d['itemCheck'] = "item = ? AND"
         args.append(name)
 
+    sqlTypeCheck, typeArgs = typeCheck(filterSet, column = 'Items.item',
+                                       db = db)
+    if sqlTypeCheck:
+        d['typeCheck'] = sqlTypeCheck + " AND"
+        args += typeArgs
+
+    d['roleIds'], roleArgs = sqlutil.bindList(roleIds)
+    args += roleArgs
+
     if latest:
-        cu.execute("""
-            SELECT idTable.item, version, ts, finalTs, SourceNameTroveInfo.data,
-                   MetadataTroveInfo.data FROM
-                (SELECT DISTINCT Items.item AS item,
-                                 Nodes.versionId AS versionId,
-                                 Nodes.timeStamps AS ts,
-                                 Nodes.finalTimeStamp as finalTs,
-                                 MIN(Instances.instanceId) AS instanceId
+        d['idQuery'] = """
+                SELECT DISTINCT Items.item AS item,
+                                Nodes.versionId AS versionId,
+                                Nodes.timeStamps AS ts,
+                                Nodes.finalTimeStamp as finalTs,
+                                MIN(Instances.instanceId) AS instanceId
                     FROM Labels
                     JOIN LabelMap USING (labelId)
                     JOIN LatestCache USING (itemId, branchId)
@@ -91,29 +440,20 @@ def searchNodes(cu, roleIds, label = None, mkUrl = None, filterSet = None,
                     JOIN Items USING (itemId)
                     WHERE %(labelCheck)s
                           %(itemCheck)s
+                          %(typeCheck)s
                           LatestCache.latestType = 1 AND
                           LatestCache.userGroupId in (%(roleIds)s)
                     GROUP BY
                           Items.item, Nodes.versionId, Nodes.timeStamps,
-                          Nodes.finalTimestamp)
-                AS idTable
-                JOIN Versions ON (idTable.versionId = Versions.versionId)
-                LEFT OUTER JOIN TroveInfo AS SourceNameTroveInfo ON
-                    idTable.instanceId = SourceNameTroveInfo.instanceId AND
-                    SourceNameTroveInfo.infoType = %(SOURCENAME)d
-                LEFT OUTER JOIN TroveInfo AS MetadataTroveInfo ON
-                    idTable.instanceId = MetadataTroveInfo.instanceId AND
-                    MetadataTroveInfo.infoType = %(METADATA)d
-        """ % d, args)
+                          Nodes.finalTimestamp
+        """ % d
     else:
-        cu.execute("""
-            SELECT idTable.item, version, ts, finalTs, SourceNameTroveInfo.data,
-                   MetadataTroveInfo.data FROM
-                (SELECT DISTINCT Items.item AS item,
-                                 Nodes.versionId AS versionId,
-                                 Nodes.timeStamps AS ts,
-                                 Nodes.finalTimeStamp as finalTs,
-                                 MIN(Instances.instanceId) AS instanceId
+        d['idQuery'] = """
+                SELECT DISTINCT Items.item AS item,
+                                Nodes.versionId AS versionId,
+                                Nodes.timeStamps AS ts,
+                                Nodes.finalTimeStamp as finalTs,
+                                MIN(Instances.instanceId) AS instanceId
                     FROM Labels
                     JOIN LabelMap USING (labelId)
                     JOIN Nodes USING (itemId, branchId)
@@ -123,10 +463,63 @@ def searchNodes(cu, roleIds, label = None, mkUrl = None, filterSet = None,
                         Instances.instanceId = ugi.instanceId
                     WHERE %(labelCheck)s
                           %(itemCheck)s
+                          %(typeCheck)s
                           ugi.userGroupId in (%(roleIds)s)
                     GROUP BY
                           Items.item, Nodes.versionId, Nodes.timeStamps,
-                          Nodes.finalTimestamp)
+                          Nodes.finalTimestamp
+        """ % d
+
+    # dedupe is set if we need to pick the latest node for each item
+    # ourself. where we can, the database does it; this uses the
+    # (itemId, finalTimestamp) index on Nodes
+    dedupe = False
+    driver = getattr(db, 'driver', None)
+    if latest and driver in ('postgresql', 'pgpool'):
+        d['distinct'] = "DISTINCT ON (idTable.item)"
+    elif latest and driver == 'sqlite':
+        # sqlite takes the bare columns of an aggregate query from the row
+        # which provided the MAX()
+        d['idQuery'] = """
+                SELECT item, versionId, ts, MAX(finalTs) AS finalTs,
+                       instanceId
+                    FROM (%(idQuery)s) AS allNodes
+                    GROUP BY item
+        """ % d
+    elif latest:
+        dedupe = True
+
+    total = None
+    if withTotal and (limit is not None or cursor):
+        if latest:
+            cu.execute("SELECT COUNT(DISTINCT item) FROM (%(idQuery)s) "
+                       "AS countTable" % d, args)
+        else:
+            cu.execute("SELECT COUNT(*) FROM (%(idQuery)s) AS countTable"
+                            % d, args)
+        total = cu.fetchone()[0]
+
+    if cursor:
+        (cursorItem, cursorTs, cursorVersion) = decodeCursor(cursor, 3)
+        if latest:
+            # only one node is returned for each item
+            seek, seekArgs = seekCheck([ ('idTable.item', '>') ],
+                                       [ cursorItem ])
+        else:
+            seek, seekArgs = seekCheck([ ('idTable.item', '>'),
+                                         ('finalTs', '<'),
+                                         ('version', '>') ],
+                                       [ cursorItem, float(cursorTs),
+                                         cursorVersion ])
+        d['where'] = "WHERE " + seek
+        args = args + seekArgs
+
+    # sort based on (name, desc(finalTimestamp), version)
+    query = """
+            SELECT %(distinct)s
+                   idTable.item, version, ts, finalTs, SourceNameTroveInfo.data,
+                   MetadataTroveInfo.data FROM
+                (%(idQuery)s)
                 AS idTable
                 JOIN Versions ON (idTable.versionId = Versions.versionId)
                 LEFT OUTER JOIN TroveInfo AS SourceNameTroveInfo ON
@@ -135,69 +528,75 @@ def searchNodes(cu, roleIds, label = None, mkUrl = None, filterSet = None,
                 LEFT OUTER JOIN TroveInfo AS MetadataTroveInfo ON
                     idTable.instanceId = MetadataTroveInfo.instanceId AND
                     MetadataTroveInfo.infoType = %(METADATA)d
-        """ % d, args)
-
-    l = list(cu)
-    filteredL = typeFilter(l, filterSet)
+                %(where)s
+                ORDER BY idTable.item, finalTs DESC, version
+    """ % d
 
-    # sort based on (name, version, desc(finalTimestamp))
-    def sortorder(x, y):
-        c = cmp(x[0], y[0])
-        if c:
-            return c
+    if limit is not None and not dedupe:
+        # one extra row tells us whether or not there is another page
+        query += " LIMIT ? OFFSET ?"
+        args = args + [ limit + 1, start ]
 
-        return -(cmp(x[3], y[3]))
+    cu.execute(query, args)
 
-    filteredL.sort(sortorder)
-
-    if latest:
-        # keep the latest
-        newL = []
+    if dedupe:
+        # keep the latest; the rows are ordered so that is the first row
+        # for each name. we stop reading once we have the window
+        filteredL = []
         last = None
-        for item in filteredL:
+        skip = start
+        for item in cu:
             if last and last[0] == item[0]:
                 continue
 
-            newL.append(item)
             last = item
+            if skip:
+                skip -= 1
+                continue
+
+            filteredL.append(item)
+            if limit is not None and len(filteredL) > limit:
+                break
+
+        if withTotal and total is None:
+            total = (start - skip) + len(filteredL)
+    else:
+        filteredL = list(cu)
+        if limit is None:
+            if withTotal and total is None:
+                total = len(filteredL)
+            filteredL = filteredL[start:]
+
+    if limit is None:
+        limit = len(filteredL)
+
+    nodeList = datamodel.NamedNodeList(start = start)
+    if total is not None:
+        nodeList.total = total
 
-        filteredL = newL
+    if limit > 0 and len(filteredL) > limit:
+        last = filteredL[limit - 1]
+        setNextPage(nodeList, 'node',
+                    encodeCursor((last[0], repr(float(last[3])), last[1])),
+                    mkUrl = mkUrl, label = label, name = name,
+                    latest = latest, filterSet = filterSet, limit = limit,
+                    withTotal = withTotal)
 
-    nodeList = datamodel.NamedNodeList(total = len(filteredL), start = 0)
+    filteredL = filteredL[:limit]
 
-    addList = []
+    sources = []
     for (name, version, ts, finalTs, sourceName, metadata) in filteredL:
         sourceName = cu.frombinary(sourceName)
         if sourceName is None and trove.troveIsSourceComponent(name):
             sourceName = name
-        addList.append((sourceName,
+        sources.append((sourceName,
                 str(versions.VersionFromString(version).getSourceVersion())))
 
-    schema.resetTable(cu, 'tmpNVF')
-
-    # This is painful, but it converts the source name from a blob to
-    # a string
-    db.bulkload("tmpNVF", [ (x[0],) + x[1] for x in enumerate(addList) ],
-                ["idx", "name", "version"],
-                start_transaction = False)
-    cu.execute("""
-        SELECT ChangeLogs.name, ChangeLogs.message, tmpNVF.name
-            FROM tmpNVF JOIN Items AS SourceItems ON
-                tmpNVF.name = SourceItems.item
-            LEFT OUTER JOIN Versions AS SourceVersion ON
-                tmpNVF.version = SourceVersion.version
-            LEFT OUTER JOIN Nodes ON
-                SourceItems.itemId = Nodes.itemId AND
-                SourceVersion.versionId = Nodes.versionId
-            LEFT OUTER JOIN ChangeLogs USING (nodeId)
-            ORDER BY tmpNVF.idx
-    """)
+    changeLogs = getChangeLogs(cu, [ x for x in sources if x[0] ])
 
     for ( (name, version, ts, finalTs, sourceName, metadata),
-          (clName, clMessage, troveName) ) in itertools.izip(filteredL, cu):
-        frzVer = versions.strToFrozen(version,
-                                      [ x for x in ts.split(":") ])
-        ver = versions.ThawVersion(frzVer)
+          source ) in itertools.izip(filteredL, sources):
+        ver = thawVersion(version, ts)
 
         shortdesc = None
 
@@ -206,10 +605,9 @@ def searchNodes(cu, roleIds, label = None, mkUrl = None, filterSet = None,
             md = trove.Metadata(metadata)
             shortdesc = md.get()['shortDesc']
 
-        if clName:
-            cl = datamodel.ChangeLog(name = clName, message = clMessage)
-        else:
-            cl = None
+        cl = changeLogs.get(source)
+        if cl:
+            cl = datamodel.ChangeLog(name = cl[0], message = cl[1])
 
         nodeList.append(name = name, version = ver, mkUrl = mkUrl,
                         changeLog = cl, shortdesc = shortdesc)
@@ -217,105 +615,175 @@ def searchNodes(cu, roleIds, label = None, mkUrl = None, filterSet = None,
     return nodeList
 
 def searchTroves(cu, roleIds, label = None, filterSet = None, mkUrl = None,
-                 latest = True, start = 0, limit = None, name = None):
-    d = { 'labelCheck' : '', 'nameCheck' : '' }
+                 latest = True, start = 0, limit = None, name = None,
+                 db = None, cursor = None, withTotal = True):
+    d = { 'labelCheck' : '', 'where' : '', 'itemCheck' : '' }
     args = []
     regex = None
     if label:
         d['labelCheck'] = "label = ? AND"
         args.append(label)
 
+    # the name and type conditions go in the id query, where the database
+    # can apply them to the Items rows of the label rather than to the
+    # finished list
+    itemChecks = []
     if name:
-        if set('?.*[]\\()+') & set(name):
-            # if only .* appears, replace them with '%' and use LIKE. this
-            # code currently fails with \.* in the regex, but neither .
-            # nor \* are valid trove names anyway
-            likeName = name
-            while '.*' in likeName:
-                likeName = likeName.replace('.*', '%')
-
-            if set('?.*[]\\()+') & set(name):
-                regex = re.compile(name)
-            else:
-                d['nameCheck'] = "WHERE item LIKE ?"
-                args.append(likeName)
-        else:
-            d['nameCheck' ] = "WHERE item = ?"
-            args.append(name)
+        clauses, nameArgs, regex = nameCheck(db, name)
+        itemChecks += clauses
+        args += nameArgs
+
+    sqlTypeCheck, typeArgs = typeCheck(filterSet, column = 'Items.item',
+                                       db = db)
+    if sqlTypeCheck:
+        itemChecks.append(sqlTypeCheck)
+        args += typeArgs
+
+    if itemChecks:
+        d['itemCheck'] = " AND ".join(itemChecks) + " AND"
 
-    d['roleIds'] = ",".join( str(x) for x in roleIds)
+    d['roleIds'], roleArgs = sqlutil.bindList(roleIds)
+    args += roleArgs
+
+    where = []
 
     if latest:
-        cu.execute("""
-            SELECT item, version, flavor, ts FROM
-                (SELECT DISTINCT Nodes.itemId AS itemId,
-                                 Nodes.versionId AS versionId, flavorId,
-                                 Nodes.timeStamps AS ts FROM Labels
+        d['idQuery'] = """
+                SELECT DISTINCT Items.item AS item,
+                                Nodes.versionId AS versionId, flavorId,
+                                Nodes.timeStamps AS ts FROM Labels
                     JOIN LabelMap USING (labelId)
                     JOIN LatestCache USING (itemId, branchId)
                     JOIN Nodes USING (itemId, versionId)
+                    JOIN Items USING (itemId)
                     WHERE %(labelCheck)s
+                          %(itemCheck)s
                           LatestCache.latestType = 1 AND
-                          LatestCache.userGroupId in (%(roleIds)s))
-                AS idTable JOIN
-                Items USING (itemId) JOIN
-                Versions ON (idTable.versionId = Versions.versionId) JOIN
-                Flavors ON (idTable.flavorId = Flavors.flavorId)
-                %(nameCheck)s
-                ORDER BY item, version, flavor
-        """ % d, *args)
+                          LatestCache.userGroupId in (%(roleIds)s)
+        """ % d
     else:
-        cu.execute("""
-            SELECT item, version, flavor, ts FROM
-                (SELECT DISTINCT Instances.itemId AS itemId,
-                                 Instances.versionId AS versionId,
-                                 Instances.flavorId AS flavorId,
-                                 Nodes.timeStamps AS ts
-                                 FROM Labels
+        d['idQuery'] = """
+                SELECT DISTINCT Items.item AS item,
+                                Instances.versionId AS versionId,
+                                Instances.flavorId AS flavorId,
+                                Nodes.timeStamps AS ts
+                                FROM Labels
                     JOIN LabelMap USING (labelId)
                     JOIN Nodes USING (itemId, branchid)
                     JOIN Instances USING (itemid, versionid)
+                    JOIN Items USING (itemId)
                     JOIN usergroupinstancescache AS ugi USING (instanceid)
                     WHERE %(labelCheck)s
-                          ugi.userGroupId in (%(roleIds)s))
+                          %(itemCheck)s
+                          ugi.userGroupId in (%(roleIds)s)
+        """ % d
+
+    query = """
+            SELECT item, version, flavor, ts FROM
+                (%(idQuery)s)
                 AS idTable JOIN
-                Items USING (itemId) JOIN
                 Versions ON (idTable.versionId = Versions.versionId) JOIN
                 Flavors ON (idTable.flavorId = Flavors.flavorId)
-                %(nameCheck)s
-                ORDER BY item, version, flavor
-        """ % d, *args)
-
-    l = list(cu)
-    filteredL = typeFilter(l, filterSet)
+                %(where)s
+    """
+
+    total = None
+    if withTotal and not regex and (limit is not None or cursor):
+        # the page we fetch doesn't tell us how many matches there are
+        cu.execute("SELECT COUNT(*) FROM (%s) AS countTable" % (query % d),
+                   *args)
+        total = cu.fetchone()[0]
+
+    if cursor:
+        seek, seekArgs = seekCheck([ ('item', '>'), ('version', '>'),
+                                     ('flavor', '>') ],
+                                   decodeCursor(cursor, 3))
+        if withTotal and regex:
+            # the database can't count the matches, so count them here
+            # before the seek hides the earlier pages
+            cu.execute(query % d, *args)
+            total = len([ x for x in cu if regex.match(x[0]) ])
+
+        where.append(seek)
+        args += seekArgs
+
+    if where:
+        d['where'] = "WHERE " + " AND ".join(where)
+
+    query += "ORDER BY item, version, flavor"
+    if limit is not None and not regex:
+        # one extra row tells us whether or not there is another page
+        query += " LIMIT ? OFFSET ?"
+        args += [ limit + 1, start ]
+
+    cu.execute(query % d, *args)
+    filteredL = list(cu)
 
     if regex:
         filteredL = [ x for x in filteredL if regex.match(x[0]) ]
 
+    if regex or limit is None:
+        if withTotal and total is None:
+            total = len(filteredL)
+        filteredL = filteredL[start:]
+
     if limit is None:
-        limit = len(filteredL) - start
+        limit = len(filteredL)
+
+    troveList = datamodel.NamedTroveIdentList(start = start)
+    if total is not None:
+        troveList.total = total
 
-    troveList = datamodel.NamedTroveIdentList(total = len(filteredL),
-                                              start = start)
+    if limit > 0 and len(filteredL) > limit:
+        last = filteredL[limit - 1]
+        setNextPage(troveList, 'trove', encodeCursor(last[0:3]),
+                    mkUrl = mkUrl, label = label, name = name,
+                    latest = latest, filterSet = filterSet, limit = limit,
+                    withTotal = withTotal)
 
-    for (name, version, flavor, ts) in filteredL[start:start + limit]:
-        flavor = str(deps.ThawFlavor(flavor))
-        frzVer = versions.strToFrozen(version,
-                                      [ x for x in ts.split(":") ])
-        ver = versions.ThawVersion(frzVer)
+    for (name, version, flavor, ts) in filteredL[:limit]:
+        flavor = flavorString(flavor)
+        ver = thawVersion(version, ts)
 
         troveList.append(name = name, version = ver, flavor = flavor,
                          mkUrl = mkUrl)
 
     return troveList
 
+def getChangeMarker(cu, roleIds):
+    """
+    Returns a value which changes whenever the troves visible to roleIds
+    may have changed. It is built from the same change stamps mirroring
+    uses, so it is cheap to compute. Those stamps only have a resolution
+    of one second, so the newest instanceId is included to catch commits
+    which happen in the same second.
+    """
+    roleList, roleArgs = sqlutil.bindList(roleIds)
+    cu.execute("""
+        SELECT (SELECT MAX(instanceId) FROM Instances),
+               (SELECT MAX(changed) FROM Instances),
+               (SELECT MAX(changed) FROM UserGroups
+                    WHERE userGroupId IN (%s))
+    """ % roleList, *roleArgs)
+
+    return tuple(str(x) for x in cu.fetchone())
+
+_accessCache = access.AccessCache()
+
+def accessibleInstances(cu, roleIds):
+    """
+    Returns an access.InstanceSet of the instances roleIds may see.
+    """
+    return _accessCache.get(cu, roleIds, getChangeMarker(cu, roleIds))
+
 def getRepository(cu, roleIds, mkUrl = None):
+    roleList, roleArgs = sqlutil.bindList(roleIds)
     cu.execute("""
         SELECT branch FROM
             (SELECT DISTINCT branchId FROM LatestCache
              WHERE userGroupId IN (%s) AND latestType=1) AS AvailBranches
             JOIN Branches USING(branchId)
-    """ % ",".join( str(x) for x in roleIds))
+    """ % roleList, *roleArgs)
 
     labels = set( str(versions.VersionFromString(x[0]).label()) for x in cu )
 
@@ -326,8 +794,85 @@ def getRepository(cu, roleIds, mkUrl = None):
 
     return repository
 
-def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
-             thisHost = None, displayFlavor = None, excludeCapsules = False):
+BUILDLOG_DIR = '/usr/src/debug/buildlogs'
+
+def getBuildLogs(cu, instanceIds):
+    """
+    Finds the files in the build log directory for all of the (debuginfo)
+    troves in instanceIds at once. Returns a dict mapping instanceId to a
+    list of (baseName, fileId) tuples, where fileId is a sha1 string.
+    """
+    logs = {}
+    if not instanceIds:
+        return logs
+
+    # this starts from the single DirNames row for the log directory, so it
+    # only visits the handful of TroveFiles rows for that directory (found
+    # through the filePathId index in conary's schema) instead of every
+    # file in every debuginfo trove
+    idList, idArgs = sqlutil.bindList(instanceIds)
+    cu.execute("""
+        SELECT DISTINCT TroveFiles.instanceId, basename, fileId
+            FROM DirNames
+            JOIN FilePaths ON (FilePaths.dirNameId = DirNames.dirNameId)
+            JOIN TroveFiles ON (TroveFiles.filePathId = FilePaths.filePathId)
+            JOIN FileStreams ON (TroveFiles.streamId = FileStreams.streamId)
+            JOIN Basenames ON (FilePaths.baseNameId = Basenames.baseNameId)
+            WHERE DirNames.dirName = ? AND
+                  TroveFiles.instanceId IN (%s)
+            ORDER BY TroveFiles.instanceId, basename
+    """ % idList, cu.binary(BUILDLOG_DIR), *idArgs)
+
+    for instanceId, baseName, fileId in cu:
+        logs.setdefault(instanceId, []).append(
+                (cu.frombinary(baseName),
+                 sha1ToString(cu.frombinary(fileId))))
+
+    return logs
+
+_TROVE_TUPLE_LISTS = [
+    ( trove._TROVEINFO_TAG_BUILDDEPS, 'builddeps' ),
+    ( trove._TROVEINFO_TAG_POLICY_PROV, 'policyprovider' ),
+    ( trove._TROVEINFO_TAG_LOADEDTROVES, 'loadedtroves' ),
+    ( trove._TROVEINFO_TAG_COPIED_FROM, 'copiedfrom' ),
+    ( trove._TROVEINFO_TAG_DERIVEDFROM, 'derivedfrom' ) ]
+
+_TROVE_INFO_TYPES = [ trove._TROVEINFO_TAG_SOURCENAME,
+                      trove._TROVEINFO_TAG_CLONEDFROM,
+                      trove._TROVEINFO_TAG_CLONEDFROMLIST,
+                      trove._TROVEINFO_TAG_BUILDTIME,
+                      trove._TROVEINFO_TAG_SIZE,
+                      trove._TROVEINFO_TAG_METADATA,
+                      trove._TROVEINFO_TAG_CAPSULE,
+                    ] + [ x[0] for x in _TROVE_TUPLE_LISTS ]
+_TROVE_INFO_LIST = ",".join(str(x) for x in _TROVE_INFO_TYPES)
+
+def _loadTroveInfo(cu, instanceIds):
+    """
+    Returns a dict mapping each of instanceIds to a dict of the trove info
+    objects (keyed by infoType) getTrove needs for it.
+    """
+    troveInfo = dict((x, {}) for x in instanceIds)
+
+    idList, idArgs = sqlutil.bindList(instanceIds)
+    cu.execute("""
+    SELECT instanceId, infoType, data FROM TroveInfo WHERE
+        instanceId IN (%s) AND infoType IN (%s)
+                """ % (idList, _TROVE_INFO_LIST), *idArgs)
+
+    for instanceId, infoType, data in cu:
+        data = cu.frombinary(data)
+        infoClass = trove.TroveInfo.streamDict[infoType][1]
+        troveInfo[instanceId][infoType] = infoClass(data)
+
+    return troveInfo
+
+def _hasCapsule(troveInfo):
+    return bool(trove._TROVEINFO_TAG_CAPSULE in troveInfo and
+                troveInfo[trove._TROVEINFO_TAG_CAPSULE].type())
+
+def _buildTrove(name, verobj, flavor, troveInfo, mkUrl = None,
+                thisHost = None, displayFlavor = None):
 
     def buildTupleList(tuples, name, mkUrl = mkUrl):
         l = getattr(datamodel.SingleTrove, name)()
@@ -337,74 +882,6 @@ def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
 
         return l
 
-    def fileQuery(gfcu, filesInstanceId, dirName = None):
-        # XXX restricing by dirName seems and obvious thing to do here,
-        # but it actually slows things down??
-        #
-        # the distinct here is unfortunate, but conary repositories had
-        # a bug for about a year which caused it to store duplicate paths
-        # if a path was committed for the first time duplicate times in
-        # a single commit job
-        gfcu.execute("""
-            SELECT DISTINCT dirName, basename, version, pathId, fileId
-                FROM TroveFiles
-                JOIN Versions USING (versionId)
-                JOIN FileStreams ON (TroveFiles.streamId = FileStreams.streamId)
-                JOIN FilePaths ON (TroveFiles.filePathId = FilePaths.filePathId)
-                JOIN DirNames ON
-                    FilePaths.dirNameId = DirNames.dirNameId
-                JOIN Basenames ON (FilePaths.baseNameId = Basenames.baseNameId)
-                WHERE TroveFiles.instanceId = ? ORDER BY dirName, basename
-        """, filesInstanceId)
-
-    cu.execute("""
-        SELECT Instances.instanceId, Nodes.timeStamps FROM Instances
-            JOIN Nodes USING (itemId, versionId)
-            JOIN Items USING (itemId)
-            JOIN Versions ON (Instances.versionId = Versions.versionId)
-            JOIN Flavors ON (Instances.flavorId = Flavors.flavorId)
-            JOIN UserGroupInstancesCache AS ugi
-                ON (instances.instanceId = ugi.instanceId AND
-                    ugi.userGroupId in (%s))
-        WHERE
-            item = ? AND version = ? AND flavor = ?
-    """ % ",".join( str(x) for x in roleIds), name, version,
-        deps.parseFlavor(flavor).freeze())
-
-    l = [ (x[0], x[1]) for x in cu ]
-    if not l:
-        return None
-
-    instanceId, timeStamps = l[0]
-    frzVer = versions.strToFrozen(version, timeStamps.split(":"))
-    verobj = versions.ThawVersion(frzVer)
-
-    tupleLists = [ ( trove._TROVEINFO_TAG_BUILDDEPS, 'builddeps' ),
-                   ( trove._TROVEINFO_TAG_POLICY_PROV, 'policyprovider' ),
-                   ( trove._TROVEINFO_TAG_LOADEDTROVES, 'loadedtroves' ),
-                   ( trove._TROVEINFO_TAG_COPIED_FROM, 'copiedfrom' ),
-                   ( trove._TROVEINFO_TAG_DERIVEDFROM, 'derivedfrom' ) ]
-
-    cu.execute("""
-    SELECT infoType, data FROM TroveInfo WHERE instanceId = ? AND
-        infoType IN (%s)
-                """ % ",".join(str(x) for x in
-                        [ trove._TROVEINFO_TAG_SOURCENAME,
-                          trove._TROVEINFO_TAG_CLONEDFROM,
-                          trove._TROVEINFO_TAG_CLONEDFROMLIST,
-                          trove._TROVEINFO_TAG_BUILDTIME,
-                          trove._TROVEINFO_TAG_SIZE,
-                          trove._TROVEINFO_TAG_METADATA,
-                          trove._TROVEINFO_TAG_CAPSULE,
-                        ] + [ x[0] for x in tupleLists ]
-                ), instanceId)
-
-    troveInfo = {}
-    for infoType, data in cu:
-        data = cu.frombinary(data)
-        infoClass = trove.TroveInfo.streamDict[infoType][1]
-        troveInfo[infoType] = infoClass(data)
-
     kwargs = { 'name' : name,
                'version' : verobj,
                'flavor' : flavor }
@@ -432,7 +909,7 @@ def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
         if md['crypto']:
             kwargs['crypto'] = [ x for x in md['crypto'] ]
 
-    for (tag, tagName) in tupleLists:
+    for (tag, tagName) in _TROVE_TUPLE_LISTS:
         if tag in troveInfo:
             kwargs[tagName] = buildTupleList(troveInfo[tag], tagName,
                                              mkUrl = mkUrl)
@@ -449,14 +926,64 @@ def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
     for ver in clonedFromList:
         t.addClonedFrom(name, ver, flavor, mkUrl = mkUrl)
 
-    hasCapsule = False
-    if trove._TROVEINFO_TAG_CAPSULE in troveInfo:
-        if troveInfo[trove._TROVEINFO_TAG_CAPSULE].type():
-            hasCapsule = True
+    return t
+
+def _fileCheck(cu, instanceIds, dirName = None):
+    # conditions (and their args) selecting the TroveFiles rows for
+    # instanceIds, optionally only those in directory dirName
+    idList, args = sqlutil.bindList(instanceIds)
+    where = [ "TroveFiles.instanceId IN (%s)" % idList ]
+    if dirName is not None:
+        where.append("DirNames.dirName = ?")
+        args.append(cu.binary(dirName))
 
-    fileQuery(cu, instanceId)
+    return " AND ".join(where), args
 
-    for (dirName, baseName, fileVersion, pathId, fileId) in cu:
+def _countFiles(cu, instanceId, dirName = None):
+    where, args = _fileCheck(cu, [ instanceId ], dirName = dirName)
+    # see _loadFiles for why this is distinct
+    cu.execute("""
+        SELECT COUNT(*) FROM
+            (SELECT DISTINCT TroveFiles.filePathId, TroveFiles.streamId,
+                             TroveFiles.versionId
+                FROM TroveFiles
+                JOIN FilePaths ON
+                    (TroveFiles.filePathId = FilePaths.filePathId)
+                JOIN DirNames ON
+                    FilePaths.dirNameId = DirNames.dirNameId
+                WHERE %s) AS countTable
+    """ % where, *args)
+
+    return cu.fetchone()[0]
+
+def _loadFiles(cu, troves, hasCapsule, excludeCapsules = False,
+               mkUrl = None, thisHost = None, dirName = None, start = 0,
+               limit = None):
+    # the distinct here is unfortunate, but conary repositories had
+    # a bug for about a year which caused it to store duplicate paths
+    # if a path was committed for the first time duplicate times in
+    # a single commit job
+    where, args = _fileCheck(cu, troves, dirName = dirName)
+    query = """
+        SELECT DISTINCT TroveFiles.instanceId, dirName, basename, version,
+                        pathId, fileId
+            FROM TroveFiles
+            JOIN Versions USING (versionId)
+            JOIN FileStreams ON (TroveFiles.streamId = FileStreams.streamId)
+            JOIN FilePaths ON (TroveFiles.filePathId = FilePaths.filePathId)
+            JOIN DirNames ON
+                FilePaths.dirNameId = DirNames.dirNameId
+            JOIN Basenames ON (FilePaths.baseNameId = Basenames.baseNameId)
+            WHERE %s
+            ORDER BY TroveFiles.instanceId, dirName, basename
+    """ % where
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        args += [ limit, start ]
+
+    cu.execute(query, *args)
+
+    for (instanceId, dirName, baseName, fileVersion, pathId, fileId) in cu:
         dirName = cu.frombinary(dirName)
         baseName = cu.frombinary(baseName)
         if pathId == trove.CAPSULE_PATHID:
@@ -464,7 +991,7 @@ def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
             contentAvailable = not excludeCapsules
         else:
             isCapsule = None
-            contentAvailable = not hasCapsule
+            contentAvailable = not hasCapsule[instanceId]
 
         fileObj = datamodel.FileReference(
                         path = os.path.join(dirName, baseName),
@@ -473,11 +1000,15 @@ def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
                         fileId = sha1ToString(cu.frombinary(fileId)),
                         isCapsule = isCapsule,
                         contentAvailable = contentAvailable,
+                        host = versionHost(fileVersion),
                         mkUrl = mkUrl, thisHost = thisHost)
-        t.addFile(fileObj)
+        troves[instanceId].addFile(fileObj)
 
+def _loadIncluded(cu, troves, mkUrl = None):
+    idList, idArgs = sqlutil.bindList(troves)
     cu.execute("""
-        SELECT item, version, flavor, TroveTroves.includedId, Nodes.timeStamps
+        SELECT TroveTroves.instanceId, item, version, flavor,
+               TroveTroves.includedId, Nodes.timeStamps
           FROM TroveTroves
             JOIN Instances ON (Instances.instanceId = TroveTroves.includedId)
             JOIN Nodes USING (itemId, versionId)
@@ -485,80 +1016,207 @@ def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
             JOIN Versions ON (Versions.versionId = Instances.versionId)
             JOIN Flavors ON (Flavors.flavorId = Instances.flavorId)
             WHERE
-                TroveTroves.instanceId = ? AND
+                TroveTroves.instanceId IN (%s) AND
                 (TroveTroves.flags & %d) = 0
-            ORDER BY item, version, flavor
-    """ % schema.TROVE_TROVES_WEAKREF, instanceId)
+            ORDER BY TroveTroves.instanceId, item, version, flavor
+    """ % (idList, schema.TROVE_TROVES_WEAKREF), *idArgs)
 
-    for (subName, subVersion, subFlavor, refInstanceId, subTS) in cu:
-        subFlavor = str(deps.ThawFlavor(subFlavor))
-        frzVer = versions.strToFrozen(subVersion,
-                [ x for x in subTS.split(":") ])
-        subV = versions.ThawVersion(frzVer)
-        t.addReferencedTrove(subName, subV, subFlavor, mkUrl = mkUrl)
+    debugInfo = []
+    for (instanceId, subName, subVersion, subFlavor, refInstanceId,
+         subTS) in cu:
+        subFlavor = flavorString(subFlavor)
+        subV = thawVersion(subVersion, subTS)
+        troves[instanceId].addReferencedTrove(subName, subV, subFlavor,
+                                              mkUrl = mkUrl)
 
         # It would be far better to use file tags to identify these build
         # logs, but it's significantly slower as well because they're in
         # the file objects rather than the trove (and those file objects
         # could be stored on a different repository)
-        if not subName.endswith(':debuginfo'):
-            continue
-
-        fileQuery(cu, refInstanceId, dirName = '/usr/src/debug/buildlogs')
-        logHost = subV.getHost()
-        for (dirName, baseName, fileVersion, pathId, fileId) in cu:
-            if (dirName) != '/usr/src/debug/buildlogs':
-                continue
+        if subName.endswith(':debuginfo'):
+            debugInfo.append((instanceId, refInstanceId, subV.getHost()))
 
+    buildLogs = getBuildLogs(cu, [ x[1] for x in debugInfo ])
+    for instanceId, refInstanceId, logHost in debugInfo:
+        t = troves[instanceId]
+        for baseName, fileId in buildLogs.get(refInstanceId, []):
             if baseName.endswith('-log.bz2'):
-                t.setBuildLog(logHost, sha1ToString(fileId))
+                t.setBuildLog(logHost, fileId)
             elif baseName.endswith('-xml.bz2'):
-                t.setXMLBuildLog(logHost, sha1ToString(fileId))
+                t.setXMLBuildLog(logHost, fileId)
+
+def _getTroves(cu, name, version, instances, mkUrl = None, thisHost = None,
+               excludeCapsules = False, withFiles = True):
+    """
+    Builds SingleTrove objects for a set of instances of name=version.
+    Instances is a list of (instanceId, timeStamps, flavor, displayFlavor)
+    tuples; the troves are returned in the same order. Each kind of data
+    is loaded for all of the instances with a single query. If withFiles
+    is False the troves link to their file lists instead of including them.
+    """
+    instanceIds = [ x[0] for x in instances ]
+    troveInfo = _loadTroveInfo(cu, instanceIds)
+
+    troves = {}
+    hasCapsule = {}
+    for (instanceId, timeStamps, flavor, displayFlavor) in instances:
+        info = troveInfo[instanceId]
+        verobj = thawVersion(version, timeStamps)
+        troves[instanceId] = _buildTrove(name, verobj,
+                                         flavor, info, mkUrl = mkUrl,
+                                         thisHost = thisHost,
+                                         displayFlavor = displayFlavor)
+        if not withFiles and mkUrl:
+            troves[instanceId].setFileList(verobj.trailingLabel().getHost())
+
+        hasCapsule[instanceId] = _hasCapsule(info)
+
+    if withFiles:
+        _loadFiles(cu, troves, hasCapsule,
+                   excludeCapsules = excludeCapsules, mkUrl = mkUrl,
+                   thisHost = thisHost)
+    _loadIncluded(cu, troves, mkUrl = mkUrl)
+
+    return [ troves[x] for x in instanceIds ]
+
+def _findTrove(cu, roleIds, name, version, flavor):
+    # returns (instanceId, timeStamps) for name=version[flavor] if roleIds
+    # can see it, None otherwise
+    cu.execute("""
+        SELECT Instances.instanceId, Nodes.timeStamps FROM Instances
+            JOIN Nodes USING (itemId, versionId)
+            JOIN Items USING (itemId)
+            JOIN Versions ON (Instances.versionId = Versions.versionId)
+            JOIN Flavors ON (Instances.flavorId = Flavors.flavorId)
+        WHERE
+            item = ? AND version = ? AND flavor = ?
+    """, name, version, deps.parseFlavor(flavor).freeze())
 
-    return t
+    l = [ (x[0], x[1]) for x in cu ]
+    if not l:
+        return None
+
+    accessible = accessibleInstances(cu, roleIds)
+    l = [ x for x in l if x[0] in accessible ]
+    if not l:
+        return None
+
+    return l[0]
+
+def getTrove(cu, roleIds, name, version, flavor, mkUrl = None,
+             thisHost = None, displayFlavor = None, excludeCapsules = False,
+             withFiles = True):
+    found = _findTrove(cu, roleIds, name, version, flavor)
+    if found is None:
+        return None
+
+    instanceId, timeStamps = found
+    return _getTroves(cu, name, version,
+                      [ (instanceId, timeStamps, flavor, displayFlavor) ],
+                      mkUrl = mkUrl, thisHost = thisHost,
+                      excludeCapsules = excludeCapsules,
+                      withFiles = withFiles)[0]
+
+def getTroveFiles(cu, roleIds, name, version, flavor, dirName = None,
+                  start = 0, limit = None, mkUrl = None, thisHost = None,
+                  excludeCapsules = False):
+    """
+    Returns a FileList of the files in name=version[flavor], sorted by path.
+    If dirName is given only files in that directory (but not its
+    subdirectories) are listed. Start and limit page through the files.
+    """
+    found = _findTrove(cu, roleIds, name, version, flavor)
+    if found is None:
+        return None
+
+    instanceId = found[0]
+    info = _loadTroveInfo(cu, [ instanceId ])[instanceId]
+
+    nvf = "%s=%s[%s]" % (name, version, flavor)
+    query = []
+    if dirName is not None:
+        query.append(('dir', dirName))
+
+    fileList = datamodel.FileList(start = start)
+    if mkUrl:
+        if query:
+            fileList.id = mkUrl('trove', nvf, 'files', query)
+        else:
+            fileList.id = mkUrl('trove', nvf, 'files')
+
+    if limit is not None:
+        fileList.total = _countFiles(cu, instanceId, dirName = dirName)
+        if start + limit < fileList.total and mkUrl:
+            fileList.next = mkUrl('trove', nvf, 'files',
+                                  query + [ ('start', str(start + limit)),
+                                            ('limit', str(limit)) ])
+
+    _loadFiles(cu, { instanceId : fileList },
+               { instanceId : _hasCapsule(info) },
+               excludeCapsules = excludeCapsules, mkUrl = mkUrl,
+               thisHost = thisHost, dirName = dirName, start = start,
+               limit = limit)
+
+    if limit is None:
+        # without a limit there's no LIMIT/OFFSET to apply the start to
+        fileList.total = len(fileList.fileref)
+        fileList.fileref = fileList.fileref[start:]
+
+    return fileList
 
 def getTroves(cu, roleIds, name, version, mkUrl = None,
               thisHost = None):
     cu.execute("""
-        SELECT DISTINCT flavor FROM Instances
+        SELECT Instances.instanceId, Nodes.timeStamps, flavor
+            FROM Instances
+            JOIN Nodes USING (itemId, versionId)
             JOIN Items USING (itemId)
             JOIN Versions ON (Instances.versionId = Versions.versionId)
             JOIN Flavors ON (Instances.flavorId = Flavors.flavorId)
-            JOIN UserGroupInstancesCache AS ugi
-                ON (instances.instanceId = ugi.instanceId AND
-                    ugi.userGroupId in (%s))
         WHERE
             item = ? AND version = ?
-    """ % ",".join( str(x) for x in roleIds), name, version)
+        ORDER BY flavor
+    """, name, version)
+
+    l = [ tuple(x) for x in cu ]
+    accessible = accessibleInstances(cu, roleIds)
+    l = [ x for x in l if x[0] in accessible ]
+    if not l:
+        return None
 
-    flavors = [ deps.ThawFlavor(x[0]) for x in cu  ]
+    flavors = [ deps.ThawFlavor(x[2]) for x in l ]
     commonFlavor = flavors[0]
     for flavor in flavors[1:]:
         commonFlavor = commonFlavor.intersection(flavor)
 
+    instances = []
+    for (instanceId, timeStamps, frozenFlavor), flavor in \
+                                            itertools.izip(l, flavors):
+        instances.append((instanceId, timeStamps, flavorString(frozenFlavor),
+                          str(flavor.difference(commonFlavor))))
 
     troves = datamodel.TroveList()
-    for flavor in flavors:
-        troves.append(getTrove(cu, roleIds, name, version, str(flavor),
-                               mkUrl = mkUrl, thisHost = thisHost,
-                               displayFlavor =
-                                    str(flavor.difference(commonFlavor))))
+    for t in _getTroves(cu, name, version, instances, mkUrl = mkUrl,
+                        thisHost = thisHost):
+        troves.append(t)
 
     return troves
 
 def _getFileStream(cu, roleIds, fileId):
+    roleList, roleArgs = sqlutil.bindList(roleIds)
     cu.execute("""
         SELECT FileStreams.stream
         FROM FileStreams
-        JOIN TroveFiles USING (streamId)
-        JOIN UserGroupInstancesCache ON
-            TroveFiles.instanceId = UserGroupInstancesCache.instanceId
         WHERE FileStreams.stream IS NOT NULL
           AND FileStreams.fileId = ?
-          AND UserGroupInstancesCache.userGroupId IN (%(roleids)s)
-          LIMIT 1
-        """ % { 'roleids' : ", ".join("%d" % x for x in roleIds) },
-        cu.binary(sha1FromString(fileId)))
+          AND EXISTS (
+            SELECT 1 FROM TroveFiles
+            JOIN UserGroupInstancesCache ON
+                TroveFiles.instanceId = UserGroupInstancesCache.instanceId
+            WHERE TroveFiles.streamId = FileStreams.streamId
+              AND UserGroupInstancesCache.userGroupId IN (%(roleids)s))
+        """ % { 'roleids' : roleList },
+        *([ cu.binary(sha1FromString(fileId)) ] + roleArgs))
 
     l = list(cu)
     if not l:
@@ -569,13 +1227,43 @@ def _getFileStream(cu, roleIds, fileId):
         return files.ThawFile(bin, None)
     return None
 
-
-def getFileInfo(cu, roleIds, fileId, mkUrl = None, path = None,
-                noContent = False):
-    f = _getFileStream(cu, roleIds, fileId)
-    if f is None:
-        return None
-
+# the most fileIds bound in one query; sqlite allows 999 parameters. this
+# is a power of two so full batches aren't padded (see sqlutil.bindList)
+FILEID_BATCH = 256
+
+def _getFileStreams(cu, roleIds, fileIds):
+    # returns a dict mapping each of fileIds which roleIds may see to its
+    # thawed file stream
+    result = {}
+    roleList, roleArgs = sqlutil.bindList(roleIds)
+    for i in range(0, len(fileIds), FILEID_BATCH):
+        fileList, fileArgs = sqlutil.bindList(
+                [ cu.binary(sha1FromString(x))
+                  for x in fileIds[i:i + FILEID_BATCH] ])
+        cu.execute("""
+            SELECT FileStreams.fileId, FileStreams.stream
+            FROM FileStreams
+            WHERE FileStreams.stream IS NOT NULL
+              AND FileStreams.fileId IN (%(fileIds)s)
+              AND EXISTS (
+                SELECT 1 FROM TroveFiles
+                JOIN UserGroupInstancesCache ON
+                    TroveFiles.instanceId =
+                            UserGroupInstancesCache.instanceId
+                WHERE TroveFiles.streamId = FileStreams.streamId
+                  AND UserGroupInstancesCache.userGroupId IN (%(roleids)s))
+            """ % { 'fileIds' : fileList, 'roleids' : roleList },
+            *(fileArgs + roleArgs))
+
+        for fileId, stream in cu:
+            stream = cu.frombinary(stream)
+            if stream is not None:
+                fileId = sha1ToString(cu.frombinary(fileId))
+                result[fileId] = files.ThawFile(stream, None)
+
+    return result
+
+def _fileModel(f, fileId, mkUrl = None, path = None, noContent = False):
     args = { 'owner' : f.inode.owner(), 'group' : f.inode.group(),
              'mtime' : f.inode.mtime(), 'perms' : f.inode.perms(),
              'fileId' : fileId, 'mkUrl' : mkUrl }
@@ -605,6 +1293,33 @@ def getFileInfo(cu, roleIds, fileId, mkUrl = None, path = None,
 
     return fx
 
+def getFileInfo(cu, roleIds, fileId, mkUrl = None, path = None,
+                noContent = False):
+    f = _getFileStream(cu, roleIds, fileId)
+    if f is None:
+        return None
+
+    return _fileModel(f, fileId, mkUrl = mkUrl, path = path,
+                      noContent = noContent)
+
+def getFileInfos(cu, roleIds, fileIds, mkUrl = None):
+    """
+    Returns a FileInfoList describing each of fileIds (sha1 strings). Files
+    which don't exist or which roleIds may not see are left out.
+    """
+    fileIds = [ x.lower() for x in fileIds ]
+    streams = _getFileStreams(cu, roleIds, sorted(set(fileIds)))
+
+    fileList = datamodel.FileInfoList()
+    seen = set()
+    for fileId in fileIds:
+        if fileId in seen or fileId not in streams:
+            continue
+        seen.add(fileId)
+        fileList.append(_fileModel(streams[fileId], fileId, mkUrl = mkUrl))
+
+    return fileList
+
 def getFileSha1(cu, roleIds, fileId):
     fStream = _getFileStream(cu, roleIds, fileId)
     if not fStream or not hasattr(fStream, 'contents'):
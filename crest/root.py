@@ -15,119 +15,447 @@
 #
 
 
-import gzip, os
+import gzip, itertools, os, string, zlib
 
-from conary.lib import util
+from conary.lib import sha1helper, util
 from restlib import controller
 from restlib import response
 from xobj import xobj
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import cache
+import jsonmodel
+import logcache
 import repquery
 
+def parseAccept(header):
+    """
+    Parses an Accept style header into a dictionary mapping each value
+    (lower cased) to its quality.
+    """
+    accepted = {}
+    if not header:
+        return accepted
+
+    for item in header.split(','):
+        parts = item.split(';')
+        value = parts[0].strip().lower()
+        if not value:
+            continue
+
+        quality = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+
+        accepted[value] = quality
+
+    return accepted
+
+def wantsJSON(request):
+    requested = request.GET.get('format', None)
+    if requested:
+        return requested == 'json'
+
+    accepted = parseAccept(request.headers.get('Accept', None))
+    jsonQuality = accepted.get('application/json', 0)
+    xmlQuality = max(accepted.get('text/xml', 0),
+                     accepted.get('application/xml', 0))
+    return jsonQuality > xmlQuality
+
+def requestKey(request, controller, methodName, kwargs):
+    """
+    Returns a string identifying everything about a request the response
+    to a (GET) method depends on, other than the repository contents and
+    the roles of the user making it.
+    """
+    params = []
+    for key, val in sorted(request.GET.items()):
+        if type(val) != list:
+            val = [ val ]
+        params += [ (key, x) for x in val ]
+
+    models = sorted((key, val) for key, val in kwargs.iteritems()
+                        if type(val) in (str, unicode))
+
+    return repr((controller.__class__.__name__, methodName,
+                 request.headers.get('Host', None), wantsJSON(request),
+                 params, models))
+
+def conditional(method):
+    """
+    Decorator for controller methods whose results only change when the
+    repository does. The response gets an ETag built from the request and
+    the repository's change marker, and requests whose If-None-Match
+    matches it get a 304 before any of the real work is done.
+    """
+    def wrapper(self, request, *args, **kwargs):
+        cu = kwargs['cu']
+        roleIds = kwargs['roleIds']
+
+        marker = repquery.getChangeMarker(cu, roleIds)
+        key = requestKey(request, self, method.__name__, kwargs)
+        etag = '"%s"' % sha1helper.sha1ToString(sha1helper.sha1String(
+                    repr((marker, sorted(roleIds), key))))
+
+        ifNoneMatch = request.headers.get('If-None-Match', None)
+        if ifNoneMatch:
+            tags = [ x.strip() for x in ifNoneMatch.split(',') ]
+            tags = [ x.startswith('W/') and x[2:] or x for x in tags ]
+            if etag in tags or '*' in tags:
+                res = response.Response(status=304)
+                res.headers['etag'] = etag
+                return res
+
+        # the etag covers everything the document depends on, so it doubles
+        # as the cache key. documents built before a commit or permission
+        # change are never looked up again and age out of the cache
+        cached = self.responseCache.get(etag)
+        if cached is not None:
+            responseClass, document = cached
+            res = responseClass(document)
+        else:
+            res = method(self, request, *args, **kwargs)
+            document = getattr(res, 'document', None)
+            if getattr(res, 'status', 200) == 200 and document is not None:
+                self.responseCache.set(etag, (res.__class__, document))
+
+        if getattr(res, 'status', 200) == 200:
+            res.headers['etag'] = etag
+
+        return res
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
 class XMLResponse(response.Response):
     def __init__(self, content, contentType='text/xml; charset=utf-8'):
         response.Response.__init__(self, content, contentType)
+        # kept for the response cache
+        self.document = content
         self.headers['cache-control'] = 'private, must-revalidate, max-age=0'
+        self.headers['vary'] = 'Accept'
 
-class FileResponse(response.FileResponse):
+class JSONResponse(XMLResponse):
+    def __init__(self, content, contentType='application/json'):
+        XMLResponse.__init__(self, content, contentType)
 
-    def __init__(self, path, remotePath=None, gzipped=False, download=True):
-        response.FileResponse.__init__(self, path=path)
-        self.headers['cache-control'] = 'private, max-age=3600'
-        if download:
-            self.headers['content-type'] = 'application/octet-stream'
-            self.headers['content-disposition'] = 'attachment'
-            if remotePath:
-                self.headers['content-disposition'] += ('; filename=%s'
-                        % (remotePath,))
-        else:
-            # Trick the browser into displaying the file inline
-            self.headers['content-type'] = 'text/plain'
+class _StreamBody(object):
 
-        if gzipped:
-            self.headers['content-encoding'] = 'gzip'
+    # the body of a StreamingResponse. Servers close the body they were
+    # given whether or not they read any of it (a closed generator which
+    # never started would skip its finally clause), so the cleanup lives
+    # in close() rather than in a generator
 
-class CompressFileResponse(response.Response):
+    def __init__(self, res):
+        self.res = res
+        self.chunks = iter(res.chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.closed:
+            raise StopIteration
+
+        try:
+            return self.chunks.next()
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            # if the client went away part way through, the chunks have
+            # to run their own cleanup before the onClose callbacks hand
+            # their resources (like a pooled connection) to someone else
+            close = getattr(self.res.chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.res.close()
+
+    def __del__(self):
+        self.close()
+
+class StreamingResponse(response.Response):
 
     def getLength(self):
         return None
 
     def get(self):
-        class Output:
+        return _StreamBody(self)
+
+    def onClose(self, func):
+        """
+        Arranges for func to be called once the body has been sent (or
+        sending it failed).
+        """
+        self._onClose.append(func)
+
+    def close(self):
+        onClose = self._onClose
+        self._onClose = []
+        for func in onClose:
+            func()
+
+    def __init__(self, chunks, contentType='text/xml; charset=utf-8'):
+        response.Response.__init__(self)
+        self.chunks = chunks
+        self._onClose = []
+        self.headers['cache-control'] = 'private, must-revalidate, max-age=0'
+        self.headers['content-type'] = contentType
+        self.headers['vary'] = 'Accept'
+
+def parseRange(header, size):
+    """
+    Parses a Range header for a resource which is size bytes long. Returns
+    None if the whole resource should be sent, (start, end) for the
+    (inclusive) byte range requested, or False if the range can't be
+    satisfied. Only single ranges are supported; requests for more than
+    one range get the whole resource.
+    """
+    if not header or '=' not in header:
+        return None
 
-            def write(self, stream):
-                self.s += stream
+    unit, spec = header.split('=', 1)
+    if unit.strip().lower() != 'bytes' or ',' in spec or '-' not in spec:
+        return None
 
-            def get(self):
-                s = self.s
-                self.s = ''
-                return s
+    first, last = [ x.strip() for x in spec.split('-', 1) ]
+    try:
+        if first:
+            start = int(first)
+            end = size - 1
+            if last:
+                end = int(last)
+                if end < start:
+                    return None
+        else:
+            # bytes=-n is the last n bytes
+            suffix = int(last)
+            if suffix < 0:
+                return None
+            elif not suffix:
+                return False
+            start = max(size - suffix, 0)
+            end = size - 1
+    except ValueError:
+        return None
 
-            def __init__(self):
-                self.s = ''
+    if start < 0:
+        return None
 
-        # we read from self.fileObj, we write to the compressor, which sticks
-        # the data in the Output object. We read from the Output object and
-        # return it from the iterator so it can be sent to the requestor
-        output = Output()
-        compressor = gzip.GzipFile(None, "w", fileobj = output)
+    if start >= size:
+        return False
 
-        BUFSZ = 1024 * 32
-        s = self.fileObj.read(BUFSZ)
-        while s:
-            compressor.write(s)
-            compressed = output.get()
-            if compressed:
-                yield compressed
-            s = self.fileObj.read(BUFSZ)
+    return start, min(end, size - 1)
 
-        compressor.close()
+def setContentHeaders(res, remotePath=None, encoding=None, download=True):
+    res.headers['cache-control'] = 'private, max-age=3600'
+    if download:
+        res.headers['content-type'] = 'application/octet-stream'
+        res.headers['content-disposition'] = 'attachment'
+        if remotePath:
+            res.headers['content-disposition'] += ('; filename=%s'
+                    % (remotePath,))
+    else:
+        # Trick the browser into displaying the file inline
+        res.headers['content-type'] = 'text/plain'
 
-        yield output.get()
+    if encoding:
+        res.headers['content-encoding'] = encoding
+    res.headers['vary'] = 'Accept-Encoding'
 
-    def __init__(self, fileObj):
-        response.Response.__init__(self)
+class FileResponse(response.FileResponse):
 
-        self.fileObj = fileObj
-        # since this is based on a fileId, no reason for it to timeout
-        self.headers['cache-control'] = 'private'
-        self.headers['content-type'] = 'text/plain'
-        self.headers['content-encoding'] = 'gzip'
+    def __init__(self, path, remotePath=None, gzipped=False, download=True):
+        response.FileResponse.__init__(self, path=path)
+        setContentHeaders(self, remotePath=remotePath,
+                          encoding=(gzipped and 'gzip' or None),
+                          download=download)
 
-class RestController(controller.RestController):
+class RangeFileResponse(response.Response):
 
-    pass
+    """
+    Partial content response which sends bytes start through end (inclusive)
+    of the file at path.
+    """
 
-class GetNode(RestController):
+    BUFSZ = 1024 * 64
 
-    def index(self, request, cu = None, roleIds = None, repos = None, *args,
-              **kwargs):
-        label = request.GET.get('label', None)
-        name = request.GET.get('name', None)
+    def getLength(self):
+        return self.end - self.start + 1
 
-        latest = request.GET.get('latest', 1)
-        latest = (latest != '0')
+    def get(self):
+        f = open(self.path, 'rb')
+        try:
+            f.seek(self.start)
+            remaining = self.getLength()
+            while remaining > 0:
+                s = f.read(min(self.BUFSZ, remaining))
+                if not s:
+                    break
+                remaining -= len(s)
+                yield s
+        finally:
+            f.close()
+
+    def __init__(self, path, byteRange, size, remotePath=None,
+                 gzipped=False, download=True):
+        response.Response.__init__(self, status=206)
+        self.path = path
+        self.start, self.end = byteRange
+        setContentHeaders(self, remotePath=remotePath,
+                          encoding=(gzipped and 'gzip' or None),
+                          download=download)
+        self.headers['content-range'] = 'bytes %d-%d/%d' % (
+                                            self.start, self.end, size)
+
+class OffloadFileResponse(response.Response):
+
+    """
+    Empty response which tells the web server in front of us to send the
+    file at path itself (X-Sendfile for Apache and lighttpd, or
+    X-Accel-Redirect for nginx). The front end handles Range requests
+    for these.
+    """
+
+    def __init__(self, path, offload, remotePath=None, gzipped=False,
+                 download=True):
+        response.Response.__init__(self)
+        header, prefix = offload
+        if prefix:
+            # X-Accel-Redirect takes a URI, which nginx maps back onto the
+            # file system with an internal location
+            path = prefix.rstrip('/') + path
+        self.headers[header.lower()] = path
+        setContentHeaders(self, remotePath=remotePath,
+                          encoding=(gzipped and 'gzip' or None),
+                          download=download)
 
-        types = request.GET.get('type', [])
-        if type(types) != list:
-            types = [ types ]
-        types = set(types)
+class CompressFileResponse(response.Response):
 
-        troves = repquery.searchNodes(cu, roleIds, label = label,
-                                      mkUrl = request.makeUrl,
-                                      filterSet = types, db = repos.db,
-                                      name = name, latest = latest)
-        return XMLResponse(xobj.toxml(troves, None))
+    """
+    Sends the contents of fileObj compressed with encoding ('gzip' or
+    'zstd'), or unchanged if encoding is None. If cacheWriter is given the
+    output is written to it as well, and committed once all of it has been
+    produced.
+    """
 
-class GetTrove(RestController):
+    BUFSZ = 1024 * 32
 
-    modelName = "troveString"
-    modelRegex = '.*\[.*\]'
+    def getLength(self):
+        return None
 
-    def index(self, request, cu = None, roleIds = None, *args, **kwargs):
-        label = request.GET.get('label', None)
-        name = request.GET.get('name', None)
+    def get(self):
+        compressor = newCompressor(self.encoding)
+        cacheWriter = self.cacheWriter
+        try:
+            s = self.fileObj.read(self.BUFSZ)
+            while s:
+                if compressor:
+                    s = compressor.compress(s)
+                if s:
+                    if cacheWriter:
+                        cacheWriter.write(s)
+                    yield s
+                s = self.fileObj.read(self.BUFSZ)
+
+            s = ''
+            if compressor:
+                s = compressor.flush()
+            if cacheWriter:
+                cacheWriter.write(s)
+                cacheWriter.commit()
+                cacheWriter = None
+            yield s
+        finally:
+            if cacheWriter:
+                # the client went away before the file was finished
+                cacheWriter.abort()
+
+    def __init__(self, fileObj, cacheWriter=None, encoding='gzip'):
+        response.Response.__init__(self)
+
+        self.fileObj = fileObj
+        self.cacheWriter = cacheWriter
+        self.encoding = encoding
+
+def newCompressor(encoding):
+    if encoding == 'gzip':
+        # zlib writes the gzip header and trailer itself with these window
+        # bits, so each compressed chunk can be sent (and cached) as soon
+        # as it is produced
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+
+    return None
+
+def setLogHeaders(res, encoding='gzip'):
+    # since this is based on a fileId, no reason for it to timeout
+    res.headers['cache-control'] = 'private'
+    res.headers['content-type'] = 'text/plain'
+    if encoding:
+        res.headers['content-encoding'] = encoding
+    res.headers['vary'] = 'Accept-Encoding'
+
+def chooseEncoding(request, available):
+    """
+    Picks the content coding for a response from the codings in available
+    (listed in our order of preference; a coding later in the list is only
+    used if the client gives it a strictly higher quality) using the
+    request's Accept-Encoding header. Returns None if the response should not be
+    encoded at all. Clients which don't send Accept-Encoding get gzip, as
+    they always have.
+    """
+    header = request.headers.get('Accept-Encoding', None)
+    if header is None:
+        return 'gzip'
+
+    accepted = parseAccept(header)
+    default = accepted.get('*', 0)
+    best = None
+    bestQuality = 0
+    for encoding in available:
+        quality = accepted.get(encoding, default)
+        if quality > bestQuality:
+            best = encoding
+            bestQuality = quality
+
+    return best
 
+class RestController(controller.RestController):
+
+    # number of results fetched from the database at a time for streamed
+    # responses
+    streamBatchSize = 1000
+
+    # documents returned by @conditional methods, shared by every
+    # controller in the process and bounded by their total size in bytes
+    responseCache = cache.LRUCache(64 * 1024 * 1024,
+                                   sizeFunc = lambda x: len(x[1]))
+
+    def getSearchArgs(self, request):
+        """
+        Returns the keyword arguments for searchNodes and searchTroves
+        given by the request's query parameters.
+        """
         latest = request.GET.get('latest', 1)
         latest = (latest != '0')
 
@@ -142,33 +470,210 @@ class GetTrove(RestController):
         else:
             limit = None
 
-        troves = repquery.searchTroves(cu, roleIds, label = label,
-                                       filterSet = types, latest = latest,
-                                       mkUrl = request.makeUrl,
-                                       start = start, limit = limit,
-                                       name = name)
+        return dict(label = request.GET.get('label', None),
+                    name = request.GET.get('name', None),
+                    latest = latest, filterSet = types,
+                    start = start, limit = limit,
+                    cursor = request.GET.get('cursor', None),
+                    withTotal = (request.GET.get('total', '1') != '0'),
+                    mkUrl = request.makeUrl)
+
+    @staticmethod
+    def getTranscodeCache(repos, name, suffix):
+        """
+        Returns the logcache.LogCache kept in directory name of the
+        repository's temporary directory, or None if there isn't one.
+        """
+        tmpPath = getattr(repos, 'tmpPath', None)
+        if not tmpPath:
+            return None
+
+        return logcache.getLogCache(os.path.join(tmpPath, name),
+                                    suffix = suffix)
+
+    @staticmethod
+    def transcode(openFile, encoding, transcodeCache, sha1):
+        """
+        Returns a response which sends the file returned by openFile() with
+        the given encoding. When transcodeCache is given, the output is
+        served from it if it's there and added to it otherwise.
+        """
+        if encoding is None or transcodeCache is None:
+            return CompressFileResponse(openFile(), encoding=encoding)
+
+        cachedPath = transcodeCache.lookup(sha1)
+        if cachedPath is not None:
+            return response.FileResponse(path=cachedPath)
+
+        return CompressFileResponse(openFile(), encoding=encoding,
+                                    cacheWriter=transcodeCache.writer(sha1))
+
+    def render(self, request, obj):
+        """
+        Returns a response containing obj as XML or JSON, whichever the
+        client asked for.
+        """
+        if wantsJSON(request):
+            return JSONResponse(jsonmodel.toJSON(obj))
+
+        return XMLResponse(xobj.toxml(obj, None))
+
+    def streamList(self, request, db, pages, tag, itemTag):
+        """
+        Returns a response which sends the results of iterPages() as a
+        single list document, serializing one batch at a time.
+        """
+        # run the first query now so errors get reported normally and the
+        # total is known for the opening tag
+        first = pages.next()
+        if wantsJSON(request):
+            return StreamingResponse(
+                        self._jsonChunks(db, first, pages, tag, itemTag),
+                        contentType = 'application/json')
+
+        return StreamingResponse(self._xmlChunks(db, first, pages, tag,
+                                                 itemTag))
+
+    def _finishStream(self, db):
+        # the callbacks finished the request before we ran our queries
+        if db.inTransaction(default=True):
+            db.commit()
+
+    def _xmlChunks(self, db, first, pages, tag, itemTag):
+        try:
+            attrs = ' start="%d"' % first.start
+            if hasattr(first, 'total'):
+                attrs += ' total="%d"' % first.total
+            yield "<?xml version='1.0' encoding='UTF-8'?>\n<%s%s>\n" % \
+                    (tag, attrs)
+
+            for page in itertools.chain([ first ], pages):
+                yield "".join(xobj.toxml(x, itemTag, xml_declaration = False)
+                              for x in getattr(page, itemTag))
+
+            yield "</%s>\n" % tag
+        finally:
+            self._finishStream(db)
+
+    def _jsonChunks(self, db, first, pages, tag, itemTag):
+        try:
+            header = { 'start' : first.start }
+            if hasattr(first, 'total'):
+                header['total'] = first.total
+            header = jsonmodel.dumps(header)
+            yield '{"%s":%s,"%s":[' % (tag, header[:-1], itemTag)
+
+            separator = ''
+            for page in itertools.chain([ first ], pages):
+                items = getattr(page, itemTag)
+                if not items:
+                    continue
+                yield separator + ",".join(
+                        jsonmodel.dumps(jsonmodel.toData(x)) for x in items)
+                separator = ','
+
+            yield ']}}'
+        finally:
+            self._finishStream(db)
 
-        return XMLResponse(xobj.toxml(troves, None))
+class GetNode(RestController):
 
-    def get(self, request, cu = None, roleIds = None, troveString = None,
-            repos = None, *args, **kwargs):
+    @conditional
+    def index(self, request, cu = None, roleIds = None, db = None, *args,
+              **kwargs):
+        searchArgs = self.getSearchArgs(request)
+        if searchArgs['cursor']:
+            try:
+                float(repquery.decodeCursor(searchArgs['cursor'], 3)[1])
+            except ValueError:
+                return response.Response(status=400)
+
+        if request.GET.get('stream', '0') != '0':
+            pages = repquery.iterPages(repquery.searchNodes, cu, roleIds,
+                                       batchSize = self.streamBatchSize,
+                                       db = db, **searchArgs)
+            return self.streamList(request, db, pages, 'nodelist',
+                                   'node')
+
+        troves = repquery.searchNodes(cu, roleIds, db = db,
+                                      **searchArgs)
+        return self.render(request, troves)
+
+class GetTrove(RestController):
+
+    modelName = "troveString"
+    modelRegex = '.*\[.*\]'
+    urls = { 'files' : { 'GET' : 'files' } }
+
+    @staticmethod
+    def splitTroveString(troveString):
         name, rest = troveString.split('=', 2)
         version, flavor = rest.split("[", 2)
         flavor = flavor[:-1]
 
+        return name, version, flavor
+
+    @conditional
+    def index(self, request, cu = None, roleIds = None, db = None, *args,
+              **kwargs):
+        searchArgs = self.getSearchArgs(request)
+        if searchArgs['cursor']:
+            try:
+                repquery.decodeCursor(searchArgs['cursor'], 3)
+            except ValueError:
+                return response.Response(status=400)
+
+        if request.GET.get('stream', '0') != '0':
+            pages = repquery.iterPages(repquery.searchTroves, cu, roleIds,
+                                       batchSize = self.streamBatchSize,
+                                       db = db, **searchArgs)
+            return self.streamList(request, db, pages, 'trovelist',
+                                   'trove')
+
+        troves = repquery.searchTroves(cu, roleIds, db = db,
+                                       **searchArgs)
+        return self.render(request, troves)
+
+    @conditional
+    def get(self, request, cu = None, roleIds = None, troveString = None,
+            repos = None, *args, **kwargs):
+        name, version, flavor = self.splitTroveString(troveString)
+
         x = repquery.getTrove(cu, roleIds, name, version, flavor,
                 mkUrl=request.makeUrl, thisHost=request.headers['Host'],
+                excludeCapsules=kwargs['excludeCapsules'],
+                withFiles=(request.GET.get('files', '1') != '0'))
+        if x is None:
+            return response.Response(status=404)
+
+        return self.render(request, x)
+
+    @conditional
+    def files(self, request, cu = None, roleIds = None, troveString = None,
+              repos = None, *args, **kwargs):
+        name, version, flavor = self.splitTroveString(troveString)
+
+        dirName = request.GET.get('dir', None)
+        if dirName is not None and dirName != '/':
+            dirName = dirName.rstrip('/')
+
+        searchArgs = self.getSearchArgs(request)
+        x = repquery.getTroveFiles(cu, roleIds, name, version, flavor,
+                dirName=dirName, start=searchArgs['start'],
+                limit=searchArgs['limit'], mkUrl=request.makeUrl,
+                thisHost=request.headers['Host'],
                 excludeCapsules=kwargs['excludeCapsules'])
         if x is None:
             return response.Response(status=404)
 
-        return XMLResponse(xobj.toxml(x, None))
+        return self.render(request, x)
 
 class GetTroves(RestController):
 
     modelName = "troveString"
     modelRegex = '.*'
 
+    @conditional
     def get(self, request, cu = None, roleIds = None, troveString = None,
             repos = None, *args, **kwargs):
         name, version = troveString.split('=', 2)
@@ -178,7 +683,9 @@ class GetTroves(RestController):
         if x is None:
             return response.Response(status=404)
 
-        return XMLResponse(xobj.toxml(x, None))
+        return self.render(request, x)
+
+_hexDigits = set(string.hexdigits)
 
 class GetFile(RestController):
 
@@ -186,6 +693,37 @@ class GetFile(RestController):
     urls = { 'info' : { 'GET' : 'info' },
              'content' : { 'GET' : 'content' }}
 
+    # the most fileIds a single batch request may ask about
+    maxFileIds = 10000
+
+    def fileInfoList(self, request, cu, roleIds, fileIds):
+        if len(fileIds) > self.maxFileIds:
+            return response.Response(status=413)
+
+        for fileId in fileIds:
+            if len(fileId) != 40 or set(fileId) - _hexDigits:
+                return response.Response(status=400)
+
+        x = repquery.getFileInfos(cu, roleIds, fileIds,
+                                  mkUrl = request.makeUrl)
+        return self.render(request, x)
+
+    @conditional
+    def index(self, request, cu = None, roleIds = None, *args, **kwargs):
+        # GET /file?fileId=...&fileId=...
+        fileIds = request.GET.get('fileId', [])
+        if type(fileIds) != list:
+            fileIds = [ fileIds ]
+
+        return self.fileInfoList(request, cu, roleIds, fileIds)
+
+    def create(self, request, cu = None, roleIds = None, *args, **kwargs):
+        # POST /file with a body of fileIds separated by white space or
+        # commas, for lists too long for a URL
+        fileIds = request.read().replace(',', ' ').split()
+        return self.fileInfoList(request, cu, roleIds, fileIds)
+
+    @conditional
     def info(self, request, cu, roleIds = None, fileId = None, **kwargs):
         path = request.GET.get('path', None)
         noContent = request.GET.get('nocontent', False)
@@ -194,7 +732,7 @@ class GetFile(RestController):
         if x is None:
             return response.Response(status=404)
 
-        return XMLResponse(xobj.toxml(x, None))
+        return self.render(request, x)
 
     def content(self, request, cu, roleIds = None, fileId = None,
                 repos = None, **kwargs):
@@ -207,8 +745,64 @@ class GetFile(RestController):
             remotePath = os.path.basename(request.unparsedPath)
         else:
             remotePath = sha1
-        return FileResponse(localPath, gzipped=True, remotePath=remotePath,
-                download=not isConfig)
+
+        # sending the stored gzipped bytes is always preferred; it allows
+        # byte ranges and offloading, and costs nothing. zstd is only used
+        # when the client ranks it strictly above gzip, and never for
+        # range requests or when the front end sends the contents
+        contentOffload = kwargs.get('contentOffload', None)
+        size = os.stat(localPath).st_size
+        available = [ 'gzip' ]
+        zstdCache = None
+        if (zstandard and not contentOffload and
+                    not request.headers.get('Range', None)):
+            available.append('zstd')
+            zstdCache = self.getTranscodeCache(repos, 'crest-content-zstd',
+                                               '.zst')
+            if zstdCache is not None and not zstdCache.fits(size):
+                # big files would just push everything else out
+                zstdCache = None
+        encoding = chooseEncoding(request, available)
+
+        if encoding != 'gzip':
+            # the stored bytes have to be decompressed (and maybe
+            # recompressed), so byte ranges and offloading don't apply
+            res = self.transcode(lambda: gzip.GzipFile(localPath, "r"),
+                                 encoding, zstdCache, sha1)
+            setContentHeaders(res, remotePath=remotePath, encoding=encoding,
+                              download=not isConfig)
+            res.headers['etag'] = '"%s-%s"' % (sha1, encoding or 'identity')
+            return res
+
+        # the stored (gzipped) bytes for a sha1 never change
+        etag = '"%s"' % sha1
+        if contentOffload:
+            res = OffloadFileResponse(localPath, contentOffload,
+                                      gzipped=True, remotePath=remotePath,
+                                      download=not isConfig)
+        else:
+            byteRange = None
+            ifRange = request.headers.get('If-Range', None)
+            if not ifRange or ifRange.strip() == etag:
+                byteRange = parseRange(request.headers.get('Range', None),
+                                       size)
+
+            if byteRange is False:
+                res = response.Response(status=416)
+                res.headers['content-range'] = 'bytes */%d' % size
+                return res
+            elif byteRange:
+                res = RangeFileResponse(localPath, byteRange, size,
+                                        gzipped=True, remotePath=remotePath,
+                                        download=not isConfig)
+            else:
+                res = FileResponse(localPath, gzipped=True,
+                                   remotePath=remotePath,
+                                   download=not isConfig)
+
+        res.headers['accept-ranges'] = 'bytes'
+        res.headers['etag'] = etag
+        return res
 
 class GetLogFile(RestController):
 
@@ -220,11 +814,32 @@ class GetLogFile(RestController):
         if sha1 is None:
             return response.Response(status=404)
 
+        available = [ 'gzip' ]
+        if zstandard:
+            available.append('zstd')
+        encoding = chooseEncoding(request, available)
+
+        if encoding == 'gzip':
+            logCache = self.getTranscodeCache(repos, 'crest-logs', '.gz')
+        elif encoding == 'zstd':
+            logCache = self.getTranscodeCache(repos, 'crest-logs-zstd',
+                                              '.zst')
+        else:
+            logCache = None
+
         localPath = repos.repos.contentsStore.hashToPath(sha1)
-        bzippedFile = gzip.GzipFile(localPath, "r")
-        uncompressedFile = util.BZ2File(bzippedFile)
+        if (logCache is not None and
+                    not logCache.fits(os.stat(localPath).st_size)):
+            # big logs would just push everything else out
+            logCache = None
+
+        def openLog():
+            bzippedFile = gzip.GzipFile(localPath, "r")
+            return util.BZ2File(bzippedFile)
 
-        return CompressFileResponse(uncompressedFile)
+        res = self.transcode(openLog, encoding, logCache, sha1)
+        setLogHeaders(res, encoding=encoding)
+        return res
 
 class Controller(RestController):
 
@@ -234,6 +849,7 @@ class Controller(RestController):
              'file'         : GetFile,
              'logfile'      : GetLogFile }
 
+    @conditional
     def index(self, request, cu = None, roleIds = None, *args, **kwargs):
         l = repquery.getRepository(cu, roleIds, mkUrl = request.makeUrl)
-        return XMLResponse(xobj.toxml(l, None))
+        return self.render(request, l)
@@ -0,0 +1,310 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Standalone server for the API which doesn't need Apache. A master process
+forks a number of workers which accept connections from a shared listening
+socket; each worker serves one request at a time.
+
+    python -m crest.server --config /srv/conary/repository.cnr \\
+        --port 8080 --workers 8 --max-requests 1000
+
+The workers share the socket the master opened (or one passed in with
+--fd), or with --reuse-port each binds its own and the kernel spreads
+connections between them. SIGHUP replaces the workers gracefully: the old
+ones finish the request they're serving and exit while new ones, which
+reread the configuration, start. SIGTERM and SIGINT stop the workers the
+same way and then the master.
+"""
+
+import BaseHTTPServer, errno, optparse, os, signal, socket, sys, time
+
+# imported by the master before forking, so the workers don't each pay for
+# loading them and share the pages
+WARM_MODULES = [
+    'conary.repository.netrepos.netserver',
+    'conary.repository.changeset',
+    'conary.dbstore',
+    'xobj.xobj',
+    'restlib.http.simplehttp',
+    'crest.root',
+    'crest.repquery',
+    'crest.webhooks',
+]
+
+def warmImports(modules = WARM_MODULES):
+    for name in modules:
+        __import__(name)
+
+def listen(address, reusePort = False, backlog = 128):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reusePort:
+        if getattr(socket, 'SO_REUSEPORT', None) is None:
+            raise RuntimeError('SO_REUSEPORT is not supported on this system')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # set by the worker
+    restHandler = None
+    prefix = '/'
+
+    def _dispatch(self):
+        if not self.path.startswith(self.prefix):
+            self.send_error(404)
+            return
+
+        self.restHandler.handle(self, self.path)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = _dispatch
+
+class WorkerServer(BaseHTTPServer.HTTPServer):
+
+    # how often the worker looks for a request to stop
+    timeout = 1
+
+    def __init__(self, sock, handlerClass):
+        BaseHTTPServer.HTTPServer.__init__(self, sock.getsockname(),
+                                           handlerClass,
+                                           bind_and_activate = False)
+        self.socket.close()
+        self.socket = sock
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.requests = 0
+
+    def process_request(self, request, clientAddress):
+        self.requests += 1
+        BaseHTTPServer.HTTPServer.process_request(self, request,
+                                                  clientAddress)
+
+    def get_request(self):
+        # every worker is woken for each new connection; the ones which
+        # lose the race get EAGAIN here, which handle_request ignores
+        conn, addr = self.socket.accept()
+        conn.setblocking(1)
+        return conn, addr
+
+class PreforkServer(object):
+
+    """
+    Runs worker processes serving requests on address. makeHandler() is
+    called in each worker after it has been forked and returns the object
+    requests are passed to (a webhooks.StandaloneHandler), so database
+    connections are never shared between processes. Workers exit after
+    serving maxRequests requests (if it's set) and are replaced.
+    """
+
+    # a worker which fails within this many seconds of starting delays
+    # its replacement, so a broken configuration doesn't spin
+    minLifetime = 1
+    pollInterval = 0.5
+
+    def __init__(self, makeHandler, address = None, sock = None,
+                 workers = 4, maxRequests = 0, reusePort = False,
+                 prefix = '/'):
+        self.makeHandler = makeHandler
+        self.address = address
+        self.reusePort = reusePort
+        self.numWorkers = workers
+        self.maxRequests = maxRequests
+        self.prefix = prefix
+        if sock is None and not reusePort:
+            sock = listen(address)
+        self.sock = sock
+        if self.sock is not None:
+            self.sock.setblocking(0)
+
+        # pid -> (generation, start time)
+        self.workers = {}
+        self.generation = 0
+        self._restart = False
+        self._stop = False
+        self._stopping = False
+
+    def serve(self):
+        signal.signal(signal.SIGHUP, self._onRestart)
+        signal.signal(signal.SIGTERM, self._onStop)
+        signal.signal(signal.SIGINT, self._onStop)
+
+        while True:
+            if self._stop:
+                self._signalWorkers(signal.SIGTERM)
+                self._stop = False
+                self._stopping = True
+
+            if self._restart:
+                self._restart = False
+                self.generation += 1
+                self._signalWorkers(signal.SIGHUP)
+
+            if self._stopping:
+                if not self.workers:
+                    break
+            else:
+                current = [ x for x in self.workers.itervalues()
+                                if x[0] == self.generation ]
+                for i in range(self.numWorkers - len(current)):
+                    self._spawn()
+
+            # polled rather than blocking, so a signal which arrives just
+            # before the wait isn't left until a worker happens to exit
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                elif e.errno == errno.ECHILD:
+                    self.workers.clear()
+                    continue
+                raise
+
+            if not pid:
+                time.sleep(self.pollInterval)
+                continue
+
+            info = self.workers.pop(pid, None)
+            if (info is not None and status and not self._stopping and
+                        time.time() - info[1] < self.minLifetime):
+                time.sleep(self.minLifetime)
+
+        if self.sock is not None:
+            self.sock.close()
+
+    def _onRestart(self, signum, frame):
+        self._restart = True
+
+    def _onStop(self, signum, frame):
+        self._stop = True
+
+    def _signalWorkers(self, signum):
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = (self.generation, time.time())
+            return
+
+        status = 1
+        try:
+            try:
+                self._work()
+                status = 0
+            except:
+                import traceback
+                traceback.print_exc()
+        finally:
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _onWorkerStop(self, signum, frame):
+        self._stopping = True
+
+    def _work(self):
+        self._stopping = False
+        self.workers = {}
+        for signum in (signal.SIGHUP, signal.SIGTERM):
+            signal.signal(signum, self._onWorkerStop)
+            # let the request being served finish undisturbed
+            signal.siginterrupt(signum, False)
+        # the master stops everything on ^C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        sock = self.sock
+        if sock is None:
+            sock = listen(self.address, reusePort = True)
+            sock.setblocking(0)
+
+        class Handler(RequestHandler):
+            restHandler = self.makeHandler()
+            prefix = self.prefix
+
+        server = WorkerServer(sock, Handler)
+        while not self._stopping:
+            if self.maxRequests and server.requests >= self.maxRequests:
+                break
+            server.handle_request()
+
+def makeReposHandler(cfgPath, prefix, port, contentOffload = None):
+    """
+    Returns a function which builds a StandaloneHandler for the repository
+    configured in cfgPath.
+    """
+    def makeHandler():
+        from conary.repository.netrepos import netserver
+        from crest import webhooks
+
+        cfg = netserver.ServerConfig()
+        cfg.read(cfgPath)
+        baseUrl = 'http://%s:%d/conary/' % (socket.getfqdn(), port)
+        repos = netserver.NetworkRepositoryServer(cfg, baseUrl)
+        return webhooks.StandaloneHandler(prefix, repos,
+                                          contentOffload = contentOffload)
+
+    return makeHandler
+
+def main(argv = sys.argv[1:]):
+    parser = optparse.OptionParser(usage = '%prog --config FILE [options]')
+    parser.add_option('--config', help = 'repository server configuration')
+    parser.add_option('--host', default = '',
+                      help = 'address to listen on (default all)')
+    parser.add_option('--port', type = 'int', default = 8080)
+    parser.add_option('--fd', type = 'int',
+                      help = 'use this already listening socket')
+    parser.add_option('--reuse-port', action = 'store_true',
+                      dest = 'reusePort', default = False,
+                      help = 'have each worker bind its own socket')
+    parser.add_option('--workers', type = 'int', default = 4)
+    parser.add_option('--max-requests', type = 'int', dest = 'maxRequests',
+                      default = 0,
+                      help = 'replace workers after this many requests')
+    parser.add_option('--prefix', default = '/conary/api/',
+                      help = 'path the API is served under')
+    options, args = parser.parse_args(argv)
+    if not options.config or args:
+        parser.error('--config is required')
+
+    sock = None
+    if options.fd is not None:
+        sock = socket.fromfd(options.fd, socket.AF_INET, socket.SOCK_STREAM)
+        port = sock.getsockname()[1]
+    else:
+        port = options.port
+
+    warmImports()
+    server = PreforkServer(
+                makeReposHandler(options.config, options.prefix, port),
+                address = (options.host, port), sock = sock,
+                workers = options.workers,
+                maxRequests = options.maxRequests,
+                reusePort = options.reusePort, prefix = options.prefix)
+    server.serve()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+def bindList(values):
+    """
+    Returns (placeholders, args) for passing values to an IN (...) list as
+    bound parameters. The list is padded to a power of two by repeating
+    its last value, so queries over role sets and id lists of any size
+    only ever use a handful of distinct statements, which the database
+    (and the driver) can plan once and reuse. An empty list becomes NULL,
+    which matches nothing.
+    """
+    values = list(values)
+    if not values:
+        return "NULL", []
+
+    size = 1
+    while size < len(values):
+        size <<= 1
+
+    args = values + values[-1:] * (size - len(values))
+    return ",".join("?" * size), args
@@ -15,21 +15,110 @@
 #
 
 
+import os
+
 import restlib.auth
 from restlib import response
 from restlib.http import simplehttp
+from conary.lib import sha1helper
 from conary.web import webauth
 
-from crest import root
+from crest import cache, dbpool, root
 
 
 class ReposCallback:
 
-    def __init__(self, repos):
+    def __init__(self, repos, contentOffload = None, authCacheTimeout = 30,
+                 authCacheSize = 10000, dbPool = None):
         self.repos = repos
+        # None to run every request on repos.db, or a dbpool.ConnectionPool
+        # for threaded servers
+        self.dbPool = dbPool
+        # None, or (header, prefix) to have the front end web server send
+        # file contents; see root.OffloadFileResponse
+        self.contentOffload = contentOffload
+        # roles for recently seen credentials. the keys are salted hashes,
+        # so passwords are never kept in memory after the request ends
+        if authCacheTimeout:
+            self.authCache = cache.TTLCache(authCacheSize, authCacheTimeout)
+        else:
+            self.authCache = None
+        self._authSalt = os.urandom(16)
+
+    def getAuthRoles(self, cu, authToken):
+        if self.authCache is None:
+            return self.repos.auth.getAuthRoles(cu, authToken)
+
+        # entries are only good for as long as the roles they name are
+        # unchanged; this stamp moves when role membership, permissions
+        # or entitlements are edited
+        cu.execute("SELECT MAX(changed) FROM UserGroups")
+        marker = cu.fetchone()[0]
+
+        key = self._authKey(authToken)
+        entry = self.authCache.get(key)
+        if entry is not None and entry[0] == marker:
+            return entry[1]
+
+        roleIds = self.repos.auth.getAuthRoles(cu, authToken)
+        # failures aren't remembered; the user may be about to be added
+        if roleIds:
+            self.authCache.set(key, (marker, roleIds))
+        else:
+            self.authCache.pop(key)
+
+        return roleIds
+
+    def _authKey(self, authToken):
+        # passwords may be ProtectedStrings, which hide their value from
+        # repr(), so the token is flattened by hand
+        parts = [ self._authSalt ]
+        def flatten(x):
+            if isinstance(x, unicode):
+                x = x.encode('utf-8')
+
+            if isinstance(x, str):
+                # slicing gets at the plain string
+                parts.append('s%d:' % len(x) + x[:])
+            elif isinstance(x, (list, tuple)):
+                parts.append('l%d:' % len(x))
+                for item in x:
+                    flatten(item)
+            else:
+                parts.append('r' + repr(x))
+
+        flatten(authToken)
+        return sha1helper.sha1String(''.join(parts))
+
+    def invalidateAuth(self):
+        """
+        Forgets all cached roles. Changes which move UserGroups.changed
+        are noticed without this; anything else, such as a new password,
+        only takes effect once the entries expire unless this is called.
+        """
+        if self.authCache is not None:
+            self.authCache.clear()
+
+    def authCacheStats(self):
+        """
+        Returns the auth cache's counters (hits, misses, expirations and so
+        on), or None if the cache is disabled.
+        """
+        if self.authCache is None:
+            return None
+
+        return self.authCache.stats()
 
     def processMethod(self, request, method, args, kwargs):
-        cu = self.repos.db.cursor()
+        if self.dbPool is None:
+            db = self.repos.db
+        else:
+            try:
+                db = self.dbPool.checkout()
+            except dbpool.PoolTimeout:
+                return response.Response(status=503)
+            request.crestDb = db
+        cu = db.cursor()
 
         authToken = getattr(request, 'authToken', None)
         if not authToken:
@@ -40,11 +129,14 @@ class ReposCallback:
             authToken = ( request.auth[0], request.auth[1], entitlementList )
 
         kwargs['repos'] = self.repos
-        kwargs['roleIds'] = self.repos.auth.getAuthRoles(cu, authToken)
+        kwargs['roleIds'] = self.getAuthRoles(cu, authToken)
         kwargs['cu'] = cu
+        kwargs['db'] = db
         kwargs['excludeCapsules'] = self.repos.excludeCapsuleContents
+        kwargs['contentOffload'] = self.contentOffload
 
         if not kwargs['roleIds']:
+            self.releaseDb(request, commit = True)
             return response.Response(status=403)
         request.repos = self.repos
         request.roleIds = kwargs['roleIds']
@@ -52,16 +144,60 @@ class ReposCallback:
         request.makeUrl = lambda *x, **kw: (self.makeUrl(request, *x, **kw))
 
     def processResponse(self, request, res):
-        if self.repos.db.inTransaction(default=True):
-            # Commit if someone left a transaction open (or the
-            # DB doesn't have a way to tell)
-            self.repos.db.commit()
+        self.releaseDb(request, commit = True, res = res)
 
     def processException(self, request, excClass, exception, tb):
-        if self.repos.db.inTransaction(default=True):
-            # Commit if someone left a transaction open (or the
-            # DB doesn't have a way to tell)
-            self.repos.db.rollback()
+        self.releaseDb(request, commit = False)
+
+    def releaseDb(self, request, commit, res = None):
+        """
+        Finishes the transaction left open by a request and, when pooling,
+        returns its connection to the pool. Streamed responses keep the
+        connection until their body has been sent.
+        """
+        if self.dbPool is None:
+            db = self.repos.db
+        else:
+            db = getattr(request, 'crestDb', None)
+            if db is None:
+                # already released
+                return
+            request.crestDb = None
+
+        try:
+            if db.inTransaction(default=True):
+                # Commit if someone left a transaction open (or the
+                # DB doesn't have a way to tell)
+                if commit:
+                    db.commit()
+                else:
+                    db.rollback()
+        except:
+            if self.dbPool is not None:
+                self.dbPool.discard(db)
+            raise
+
+        if self.dbPool is None:
+            return
+
+        if isinstance(res, root.StreamingResponse):
+            self.dbPool.detach(db)
+            res.onClose(lambda: self._checkinStream(db))
+        else:
+            self.dbPool.checkin(db)
+
+    def _checkinStream(self, db):
+        # the stream commits when it finishes; anything still open here
+        # was left by a stream which failed, and mustn't go back to the
+        # pool with the connection
+        try:
+            if db.inTransaction(default=False):
+                db.rollback()
+        except:
+            self.dbPool.discard(db)
+            raise
+
+        self.dbPool.checkin(db)
 
     def makeUrl(self, request, *args, **kwargs):
         baseUrl = None
@@ -86,11 +222,20 @@ class StandaloneHandler:
     def handle(self, req, path):
         return self.h.handle(req, pathPrefix=self.prefix)
 
-    def __init__(self, rootUri, repos):
+    def __init__(self, rootUri, repos, contentOffload = None, dbPool = None):
         self.prefix = rootUri
         self.h = self.handlerClass(root.Controller(None, self.prefix))
         self.h.addCallback(AuthCallback())
-        self.h.addCallback(ReposCallback(repos))
+        self.reposCallback = ReposCallback(repos,
+                                           contentOffload = contentOffload,
+                                           dbPool = dbPool)
+        self.h.addCallback(self.reposCallback)
+
+    def invalidateAuth(self):
+        self.reposCallback.invalidateAuth()
+
+    def authCacheStats(self):
+        return self.reposCallback.authCacheStats()
 
 try:
     from restlib.http import modpython as restmodpython
@@ -0,0 +1,149 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import threading, time
+
+from testrunner import testhelp
+
+from crest import access
+
+class Cursor:
+
+    # answers the UserGroupInstancesCache query from a dict of
+    # roleId -> instanceIds, and the Instances probe from a dict of
+    # instanceId -> changed
+    def __init__(self, instances, changed = None):
+        self.instances = instances
+        self.changed = changed or {}
+        self.queries = []
+        self.probes = 0
+        self.rows = []
+
+    def execute(self, sql, *args):
+        args = list(args)
+        if 'FROM Instances' in sql:
+            self.probes += 1
+            lastId, since = args
+            self.rows = [ (1,) for x, changed in self.changed.iteritems()
+                          if x <= lastId and changed > int(since) ][:1]
+            return
+
+        minId = 0
+        if 'instanceId >' in sql:
+            minId = args.pop()
+        self.queries.append(minId)
+        found = set()
+        for roleId in args:
+            found.update(x for x in self.instances.get(roleId, [])
+                         if x > minId)
+        self.rows = [ (x,) for x in found ]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetchone(self):
+        if self.rows:
+            return self.rows[0]
+        return None
+
+class AccessTest(testhelp.TestCase):
+
+    def testInstanceSet(self):
+        s = access.InstanceSet([ 1, 8, 9, 1000 ], 'm')
+        assert([ x for x in range(1010) if x in s ] == [ 1, 8, 9, 1000 ])
+        assert(2000 not in s)
+        assert(s.filter([ 9, 10, 1000 ]) == [ 9, 1000 ])
+        assert(s.size() == 126)
+
+        s2 = s.extend([ 2, 2000 ], 'm2')
+        assert(s2.filter([ 1, 2, 3, 2000 ]) == [ 1, 2, 2000 ])
+        assert(s2.marker == 'm2')
+        # the original is left alone
+        assert(2 not in s and 2000 not in s)
+
+        s = access.InstanceSet([], 'm')
+        assert(1 not in s)
+
+    def testAccessCache(self):
+        cu = Cursor({ 1 : [ 10, 11, 12 ], 2 : [ 20 ] },
+                    { 10 : 1, 11 : 1, 12 : 1, 20 : 1 })
+        c = access.AccessCache()
+        s = c.get(cu, [ 1, 2 ], ('20', '1', 'r1'))
+        assert(s.filter([ 10, 11, 12, 13, 20 ]) == [ 10, 11, 12, 20 ])
+        assert(c.get(cu, [ 2, 1 ], ('20', '1', 'r1')) is s)
+        assert(cu.queries == [ 0 ])
+
+        # a commit only reads the new instances
+        cu.instances[2].append(21)
+        cu.changed[21] = 2
+        s = c.get(cu, [ 1, 2 ], ('21', '2', 'r1'))
+        assert(21 in s and 10 in s)
+        assert(cu.queries == [ 0, 20 ])
+        assert(cu.probes == 1)
+
+        # permission changes read everything again
+        cu.instances[1].remove(10)
+        s = c.get(cu, [ 1, 2 ], ('21', '2', 'r2'))
+        assert(10 not in s and 21 in s)
+        assert(cu.queries == [ 0, 20, 0 ])
+
+        # so do changes to existing instances
+        cu.instances[1].remove(11)
+        cu.changed[11] = 3
+        s = c.get(cu, [ 1, 2 ], ('21', '3', 'r2'))
+        assert(11 not in s)
+        assert(cu.queries == [ 0, 20, 0, 0 ])
+
+        # even when they come along with a commit
+        cu.instances[1].remove(12)
+        cu.changed[12] = 4
+        cu.instances[1].append(22)
+        cu.changed[22] = 4
+        s = c.get(cu, [ 1, 2 ], ('22', '4', 'r2'))
+        assert(12 not in s and 22 in s)
+        assert(cu.queries == [ 0, 20, 0, 0, 0 ])
+
+        c.get(cu, [ 1 ], ('22', '4', 'r2'))
+        c.invalidate([ 1 ])
+        c.get(cu, [ 1 ], ('22', '4', 'r2'))
+        assert(len(cu.queries) == 7)
+        c.invalidate()
+        c.get(cu, [ 1, 2 ], ('22', '4', 'r2'))
+        assert(len(cu.queries) == 8)
+
+        # an empty repository has no newest instance
+        s = c.get(cu, [ 3 ], ('None', 'None', 'None'))
+        assert(c.get(cu, [ 3 ], ('None', 'None', 'None')) is s)
+
+    def testConcurrentBuild(self):
+        class SlowCursor(Cursor):
+            def execute(self, sql, *args):
+                time.sleep(0.1)
+                Cursor.execute(self, sql, *args)
+
+        cu = SlowCursor({ 1 : [ 10 ] })
+        c = access.AccessCache()
+        results = []
+        def get():
+            results.append(c.get(cu, [ 1 ], ('10', 't', 'r')))
+        threads = [ threading.Thread(target = get) for x in range(4) ]
+        [ x.start() for x in threads ]
+        [ x.join() for x in threads ]
+
+        # the threads waited for the one reading the rows
+        assert(cu.queries == [ 0 ])
+        assert(len(set(id(x) for x in results)) == 1)
@@ -0,0 +1,119 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro benchmarks for the per-row work done by crest listings. Run as
+
+    python crest_test/benchmark.py [rows] [name ...]
+"""
+
+import sys, time
+
+from conary import versions
+from conary.deps import deps
+from xobj import xobj
+
+from crest import datamodel, repquery
+
+_flavors = [ '', 'is: x86', 'is: x86_64', 'ssl is: x86',
+             '~!bootstrap,ssl is: x86_64' ]
+
+def _rows(count, distinctVersions = 50):
+    # (version, timeStamps, frozenFlavor) the way the listing queries
+    # return them; like a real label, a few versions and flavors repeat
+    # over and over
+    frozen = [ deps.parseFlavor(x).freeze() for x in _flavors ]
+    rows = []
+    for i in xrange(count):
+        n = i % distinctVersions
+        rows.append(('/localhost@rpl:linux/1.%d-1-1' % n,
+                     '%d.000' % (1238075164 + n),
+                     frozen[i % len(frozen)]))
+
+    return rows
+
+def benchThaw(count):
+    rows = _rows(count)
+
+    start = time.time()
+    for version, ts, flavor in rows:
+        str(deps.ThawFlavor(flavor))
+        versions.ThawVersion(versions.strToFrozen(version, ts.split(":")))
+    direct = time.time() - start
+
+    repquery._versionCache.clear()
+    repquery._flavorCache.clear()
+    start = time.time()
+    for version, ts, flavor in rows:
+        repquery.flavorString(flavor)
+        repquery.thawVersion(version, ts)
+    memo = time.time() - start
+
+    return [ ('thaw (uncached)', direct), ('thaw (memoized)', memo) ]
+
+def _mkUrl(*args, **kwargs):
+    return 'http://localhost/api/' + '/'.join(str(x) for x in args[:3])
+
+def _buildTrove(count, hostFn):
+    version = versions.VersionFromString('/localhost@rpl:linux/1.0-1-1')
+    t = datamodel.SingleTrove(name = 'group-big', version = version,
+                              flavor = '', mkUrl = _mkUrl)
+    for i in xrange(count):
+        fileVersion = '/localhost@rpl:linux/1.%d-1-1' % (i % 20)
+        t.addFile(datamodel.FileReference(
+                        path = '/usr/share/big/%d' % i,
+                        version = fileVersion,
+                        pathId = '%032x' % i, fileId = '%040x' % i,
+                        contentAvailable = True,
+                        host = hostFn(fileVersion), mkUrl = _mkUrl))
+
+    return t
+
+def benchTroveFiles(count):
+    # builds and renders a /trove/<nvf> document with count files
+    results = []
+    for desc, hostFn in [ ('trove (parsed hosts)', lambda x: None),
+                          ('trove (cached hosts)', repquery.versionHost) ]:
+        repquery._hostCache.clear()
+        start = time.time()
+        t = _buildTrove(count, hostFn)
+        built = time.time()
+        xobj.toxml(t, 'trove')
+        done = time.time()
+        results.append((desc + ' build', built - start))
+        results.append((desc + ' render', done - built))
+
+    return results
+
+benchmarks = [ ('thaw', benchThaw), ('trovefiles', benchTroveFiles) ]
+
+def main(argv):
+    count = 100000
+    if len(argv) > 1 and argv[1].isdigit():
+        count = int(argv[1])
+        argv = argv[1:]
+    names = argv[1:]
+
+    for name, fn in benchmarks:
+        if names and name not in names:
+            continue
+
+        for desc, elapsed in fn(count):
+            print "%-24s %8.3fs %8.2fus/row" % (desc, elapsed,
+                                                elapsed * 1e6 / count)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,91 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from testrunner import testhelp
+
+from crest import cache
+
+class CacheTest(testhelp.TestCase):
+
+    def testLRU(self):
+        c = cache.LRUCache(3)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.set('c', 3)
+        assert(c.get('a') == 1)
+        c.set('d', 4)
+        # b was the least recently used
+        assert('b' not in c)
+        assert(c.get('b') is None)
+        assert([ c.get(x) for x in 'acd' ] == [ 1, 3, 4 ])
+        assert(len(c) == 3)
+
+        c.set('a', 5)
+        assert(c.get('a') == 5)
+        assert(len(c) == 3)
+        assert(c.pop('a') == 5)
+        assert(c.pop('a') is None)
+        assert(len(c) == 2)
+
+        self.assertEqual(c.stats(),
+                         { 'entries' : 2, 'size' : 2, 'maxSize' : 3,
+                           'hits' : 5, 'misses' : 1, 'evictions' : 1 })
+
+        c.clear()
+        assert(len(c) == 0)
+        assert(c.size == 0)
+        c.set('e', 6)
+        assert(c.get('e') == 6)
+
+    def testSized(self):
+        c = cache.LRUCache(10, sizeFunc = len)
+        c.set(1, 'abcd')
+        c.set(2, 'efgh')
+        assert(c.size == 8)
+        c.set(3, 'ijkl')
+        assert(1 not in c)
+        assert(c.size == 8)
+        assert(c.evictions == 1)
+
+        # too big to cache at all
+        c.set(4, 'x' * 11)
+        assert(4 not in c)
+        assert(c.size == 8)
+
+    def testTTL(self):
+        now = [ 100 ]
+        c = cache.TTLCache(2, 10, timeFunc = lambda: now[0])
+        c.set('a', 1)
+        now[0] = 105
+        c.set('b', 2)
+        assert(c.get('a') == 1)
+        now[0] = 110
+        # a has expired, b hasn't
+        assert(c.get('a') is None)
+        assert(c.get('b') == 2)
+        assert(c.pop('b') == 2)
+        assert(c.pop('b') is None)
+
+        c.set('c', 3)
+        c.set('d', 4)
+        c.set('e', 5)
+        assert(c.get('c') is None)
+        self.assertEqual(c.stats(),
+                         { 'entries' : 2, 'size' : 2, 'maxSize' : 2,
+                           'hits' : 2, 'misses' : 2, 'evictions' : 1,
+                           'expirations' : 1 })
+
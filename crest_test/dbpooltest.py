@@ -0,0 +1,136 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import threading
+
+from testrunner import testhelp
+
+from crest import dbpool
+
+class Database:
+
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+        self.checks = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.checks += 1
+        if self.broken:
+            raise RuntimeError('connection lost')
+
+    def fetchall(self):
+        return [ (1,) ]
+
+    def inTransaction(self, default = None):
+        return False
+
+    def close(self):
+        self.closed = True
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class DbPoolTest(testhelp.TestCase):
+
+    def _pool(self, **kwargs):
+        self.opened = []
+        def connect():
+            db = Database()
+            self.opened.append(db)
+            return db
+
+        self.clock = Clock()
+        return dbpool.ConnectionPool(connect, timeFunc = self.clock, **kwargs)
+
+    def testCheckout(self):
+        pool = self._pool(maxSize = 2)
+        db = pool.checkout()
+        # the same thread gets the same connection back
+        assert(pool.checkout() is db)
+        pool.checkin(db)
+        assert(pool.stats()['idle'] == 0)
+        pool.checkin(db)
+        assert(pool.stats()['idle'] == 1)
+
+        assert(pool.checkout() is db)
+        assert(len(self.opened) == 1)
+        pool.checkin(db)
+
+        # another thread gets its own
+        other = []
+        def run():
+            other.append(pool.checkout())
+            pool.checkin(other[0])
+        db = pool.checkout()
+        t = threading.Thread(target = run)
+        t.start()
+        t.join()
+        assert(other[0] is not db)
+        assert(pool.stats()['open'] == 2)
+        pool.checkin(db)
+
+    def testMaxSize(self):
+        pool = self._pool(maxSize = 1, timeout = 0)
+        db = pool.checkout()
+        pool.detach(db)
+        self.assertRaises(dbpool.PoolTimeout, pool.checkout)
+        pool.checkin(db)
+        assert(pool.checkout() is db)
+
+    def testRecycle(self):
+        pool = self._pool(maxIdle = 300, checkInterval = 30)
+        db = pool.checkout()
+        pool.checkin(db)
+
+        # recently used connections aren't checked
+        self.clock.now += 10
+        assert(pool.checkout() is db)
+        assert(db.checks == 0)
+        pool.checkin(db)
+
+        self.clock.now += 60
+        assert(pool.checkout() is db)
+        assert(db.checks == 1)
+        pool.checkin(db)
+
+        # broken connections are replaced
+        self.clock.now += 60
+        db.broken = True
+        new = pool.checkout()
+        assert(new is not db and db.closed)
+        assert(pool.stats()['failedChecks'] == 1)
+        pool.checkin(new)
+
+        # idle ones are closed
+        self.clock.now += 301
+        db = pool.checkout()
+        assert(db is not new and new.closed)
+        assert(pool.stats()['open'] == 1)
+        pool.checkin(db)
+
+        pool.close()
+        assert(db.closed)
+        assert(pool.stats()['open'] == 0)
@@ -0,0 +1,102 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os, shutil, tempfile
+
+from testrunner import testhelp
+
+from crest import logcache
+
+class LogCacheTest(testhelp.TestCase):
+
+    def setUp(self):
+        testhelp.TestCase.setUp(self)
+        self.dir = tempfile.mkdtemp(prefix = 'logcache-')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        testhelp.TestCase.tearDown(self)
+
+    def _add(self, c, sha1, contents):
+        w = c.writer(sha1)
+        w.write(contents)
+        w.commit()
+
+    def testLookup(self):
+        c = logcache.LogCache(self.dir)
+        assert(c.lookup('aa') is None)
+        self._add(c, 'aa', 'contents')
+        assert(open(c.lookup('aa')).read() == 'contents')
+
+        w = c.writer('bb')
+        w.write('partial')
+        w.abort()
+        assert(c.lookup('bb') is None)
+        assert(os.listdir(self.dir) == [ 'aa.gz' ])
+
+    def testPrune(self):
+        c = logcache.LogCache(self.dir, maxSize = 10)
+        self._add(c, 'aa', '1234')
+        self._add(c, 'bb', '1234')
+        os.utime(os.path.join(self.dir, 'aa.gz'), (1000, 1000))
+        os.utime(os.path.join(self.dir, 'bb.gz'), (2000, 2000))
+        # a hit makes aa the most recently used
+        assert(c.lookup('aa'))
+        self._add(c, 'cc', '1234')
+        assert(c.lookup('bb') is None)
+        assert(c.lookup('aa') and c.lookup('cc'))
+
+        # entries bigger than the whole cache don't stay around
+        self._add(c, 'dd', '12345678901')
+        assert(c.lookup('dd') is None)
+
+    def testPruneTemp(self):
+        c = logcache.LogCache(self.dir, maxSize = 10)
+        stale = os.path.join(self.dir, '.tmp-stale')
+        open(stale, 'w').write('123')
+        os.utime(stale, (1000, 1000))
+        fresh = os.path.join(self.dir, '.tmp-fresh')
+        open(fresh, 'w').write('1234')
+
+        # writers which died don't leave their files behind, but the ones
+        # still being written count against the size
+        self._add(c, 'aa', '1234')
+        assert(not os.path.exists(stale))
+        assert(os.path.exists(fresh))
+        os.utime(os.path.join(self.dir, 'aa.gz'), (2000, 2000))
+        self._add(c, 'bb', '123')
+        assert(c.lookup('aa') is None)
+        assert(c.lookup('bb'))
+
+    def testSizeEstimate(self):
+        c = logcache.LogCache(self.dir, maxSize = 10)
+        self._add(c, 'aa', '12')
+        # files added behind the cache's back aren't seen until its own
+        # additions push it past maxSize
+        other = os.path.join(self.dir, 'zz.gz')
+        open(other, 'w').write('12345678')
+        os.utime(other, (1000, 1000))
+        self._add(c, 'bb', '12')
+        assert(os.path.exists(other))
+        self._add(c, 'cc', '1234567')
+        assert(not os.path.exists(other))
+        assert(c.lookup('cc'))
+
+    def testFits(self):
+        c = logcache.LogCache(self.dir, maxSize = 1600)
+        assert(c.fits(100))
+        assert(not c.fits(101))
@@ -16,6 +16,7 @@
 
 
 import base64
+import json
 import lxml
 import os
 import urllib, urllib2, urlparse
@@ -27,7 +28,7 @@ from conary_test.auth_helper import AuthHelper
 from conary import trove
 from conary.lib import util
 
-from crest import datamodel
+from crest import datamodel, repquery, root, webhooks
 
 from conary import versions
 
@@ -42,7 +43,8 @@ class RestTest(AuthHelper):
     def makeHandler(self):
         class Handler:
             def c(self, url, raw = False, auth = ('test', 'foo'),
-                  entitlements = [], checkHeaders = {}):
+                  entitlements = [], checkHeaders = {}, headers = {},
+                  withHeaders = False, data = None):
                 if not url.startswith('http:'):
                     url = 'http://localhost' + url
 
@@ -58,7 +60,7 @@ class RestTest(AuthHelper):
                 else:
                     finalUrl = url
 
-                req = urllib2.Request(finalUrl)
+                req = urllib2.Request(finalUrl, data)
 
                 if auth:
                     req.add_header('Authorization',
@@ -68,6 +70,9 @@ class RestTest(AuthHelper):
                     l = [ "* %s" % base64.b64encode(x) for x in entitlements ]
                     req.add_header('X-Conary-Entitlement', " ".join(l))
 
+                for key, val in headers.iteritems():
+                    req.add_header(key, val)
+
                 f = urllib2.urlopen(req)
                 for key, val in checkHeaders.iteritems():
                     assert(f.headers[key] == val)
@@ -75,10 +80,13 @@ class RestTest(AuthHelper):
                 s = f.read()
                 f.close()
 
-                if raw:
-                    return s
+                if not raw:
+                    s = xobj.parse(s)
+
+                if withHeaders:
+                    return f.headers, s
 
-                return xobj.parse(s)
+                return s
 
             def e(self, *args, **kwargs):
                 try:
@@ -132,6 +140,66 @@ class RestTest(AuthHelper):
         resp = handler.c('/', auth = ('user2', 'pw2'))
         assert('label' not in resp.repository.__dict__)
 
+    def testAuthCache(self):
+        class Auth:
+            def __init__(self):
+                self.lookups = 0
+
+            def getAuthRoles(self, cu, authToken):
+                self.lookups += 1
+                if authToken[:2] == ('user1', 'pw1'):
+                    return set([ 1 ])
+                return set()
+
+        class Repos:
+            def __init__(self):
+                self.auth = Auth()
+
+        class Cursor:
+            changed = '100'
+
+            def execute(self, sql):
+                assert('UserGroups' in sql)
+
+            def fetchone(self):
+                return (self.changed, )
+
+        cb = webhooks.ReposCallback(Repos())
+        auth = cb.repos.auth
+        cu = Cursor()
+
+        # a repeated request is served from the cache
+        good = ('user1', 'pw1', [])
+        assert(cb.getAuthRoles(cu, good) == set([ 1 ]))
+        assert(cb.getAuthRoles(cu, ('user1', 'pw1', [])) == set([ 1 ]))
+        assert(auth.lookups == 1)
+        assert(cb.authCacheStats()['hits'] == 1)
+
+        # a wrong password for a cached user isn't
+        assert(cb.getAuthRoles(cu, ('user1', 'pw2', [])) == set())
+        assert(auth.lookups == 2)
+        # and failures aren't remembered
+        assert(cb.getAuthRoles(cu, ('user1', 'pw2', [])) == set())
+        assert(auth.lookups == 3)
+        assert(cb.authCacheStats()['entries'] == 1)
+
+        # role changes invalidate the cache
+        cu.changed = '101'
+        assert(cb.getAuthRoles(cu, good) == set([ 1 ]))
+        assert(auth.lookups == 4)
+        assert(cb.getAuthRoles(cu, good) == set([ 1 ]))
+        assert(auth.lookups == 4)
+
+        cb.invalidateAuth()
+        assert(cb.getAuthRoles(cu, good) == set([ 1 ]))
+        assert(auth.lookups == 5)
+
+        cb = webhooks.ReposCallback(Repos(), authCacheTimeout = 0)
+        assert(cb.authCacheStats() is None)
+        cb.getAuthRoles(cu, good)
+        cb.getAuthRoles(cu, good)
+        assert(cb.repos.auth.lookups == 2)
+
     @staticmethod
     def nvf(trv):
         return '%s=%s[%s]' % (trv.getName(), trv.getVersion(),
@@ -222,6 +290,121 @@ class RestTest(AuthHelper):
         assert(urllib.unquote(resp.trove.clonedfrom.trovelist.trove.id).endswith(
                      '/trove/foo:source=/localhost@ns:user1/1.0-1[]'))
 
+    def testParseRange(self):
+        assert(root.parseRange(None, 10) is None)
+        assert(root.parseRange('bytes=0-9', 10) == (0, 9))
+        assert(root.parseRange('bytes=5-', 10) == (5, 9))
+        assert(root.parseRange('bytes=2-100', 10) == (2, 9))
+        assert(root.parseRange('bytes=-3', 10) == (7, 9))
+        assert(root.parseRange('bytes=-30', 10) == (0, 9))
+        assert(root.parseRange('bytes=10-', 10) is False)
+        assert(root.parseRange('bytes=-0', 10) is False)
+        assert(root.parseRange('bytes=3-1', 10) is None)
+        assert(root.parseRange('bytes=0-1,4-5', 10) is None)
+        assert(root.parseRange('lines=0-1', 10) is None)
+
+    def testStreamingClose(self):
+        log = []
+        def chunks():
+            try:
+                for i in range(10):
+                    yield str(i)
+            finally:
+                log.append('finish')
+
+        # the client drops the connection after the first chunk; the
+        # chunks' own cleanup has to run before the close callbacks
+        res = root.StreamingResponse(chunks())
+        res.onClose(lambda: log.append('close'))
+        body = res.get()
+        assert(body.next() == '0')
+        del body
+        assert(log == [ 'finish', 'close' ])
+
+        log[:] = []
+        res = root.StreamingResponse(chunks())
+        res.onClose(lambda: log.append('close'))
+        assert("".join(res.get()) == '0123456789')
+        assert(log == [ 'finish', 'close' ])
+
+        # the body is closed before anything is read from it (a HEAD
+        # request, say); the callbacks still run, once
+        log[:] = []
+        res = root.StreamingResponse(chunks())
+        res.onClose(lambda: log.append('close'))
+        body = res.get()
+        body.close()
+        assert(log == [ 'close' ])
+        body.close()
+        del body
+        assert(log == [ 'close' ])
+
+    def testChooseEncoding(self):
+        class Request:
+            def __init__(self, header):
+                self.headers = {}
+                if header is not None:
+                    self.headers['Accept-Encoding'] = header
+
+        def _choose(header, available = [ 'gzip', 'zstd' ]):
+            return root.chooseEncoding(Request(header), available)
+
+        assert(_choose(None) == 'gzip')
+        assert(_choose('gzip') == 'gzip')
+        # ties go to gzip, which browsers always send along with zstd
+        assert(_choose('gzip, zstd') == 'gzip')
+        assert(_choose('gzip, deflate, br, zstd') == 'gzip')
+        assert(_choose('gzip;q=0.5, zstd') == 'zstd')
+        assert(_choose('zstd') == 'zstd')
+        assert(_choose('gzip, zstd', available = [ 'gzip' ]) == 'gzip')
+        assert(_choose('gzip, zstd;q=0.5') == 'gzip')
+        assert(_choose('identity') is None)
+        assert(_choose('gzip;q=0') is None)
+        assert(_choose('*') == 'gzip')
+        assert(_choose('*, zstd;q=0') == 'gzip')
+        assert(_choose('') is None)
+
+    def testTroveFiles(self):
+        handler = self.makeHandler()
+        trv = self.addComponent('foo:runtime=localhost@ns:user1/1.0-1-1',
+                                [ (x, 'contents of %s\n' % x) for x in
+                                    [ '/etc/foo.conf', '/usr/bin/a',
+                                      '/usr/bin/b', '/usr/bin/c',
+                                      '/usr/bin/sub/d' ] ])
+        troveUri = '/trove/%s' % self.nvf(trv)
+
+        def _paths(resp):
+            fileref = resp.filelist.fileref
+            if type(fileref) != list:
+                fileref = [ fileref ]
+            return [ x.path for x in fileref ]
+
+        resp = handler.c(troveUri + '?files=0')
+        assert('fileref' not in resp.trove.__dict__)
+        assert(urllib.unquote(resp.trove.filelist.id).endswith(
+                                    urllib.unquote(troveUri) + '/files'))
+
+        resp = handler.c(troveUri + '/files')
+        assert(_paths(resp) == [ '/etc/foo.conf', '/usr/bin/a', '/usr/bin/b',
+                                 '/usr/bin/c', '/usr/bin/sub/d' ])
+        assert(int(resp.filelist.total) == 5)
+
+        resp = handler.c(troveUri + '/files?dir=/usr/bin/')
+        assert(_paths(resp) == [ '/usr/bin/a', '/usr/bin/b', '/usr/bin/c' ])
+
+        resp = handler.c(troveUri + '/files?dir=/usr/bin&start=1&limit=1')
+        assert(_paths(resp) == [ '/usr/bin/b' ])
+        assert(int(resp.filelist.total) == 3)
+        assert(int(resp.filelist.start) == 1)
+        resp = handler.c(resp.filelist.next)
+        assert(_paths(resp) == [ '/usr/bin/c' ])
+        assert('next' not in resp.filelist.__dict__)
+
+        resp = handler.c(troveUri + '/files?dir=/missing')
+        assert('fileref' not in resp.filelist.__dict__)
+
+        handler.e(troveUri + '/files', auth = ('user2', 'pw2'))
+
     def testGetFile(self):
         handler = self.makeHandler()
         trv = self.addComponent(
@@ -290,11 +473,146 @@ class RestTest(AuthHelper):
                     'content-type': 'application/octet-stream', })
         assert(util.decompressString(contents) == 'fileContents')
 
+        # partial content of the stored (gzipped) bytes
+        headers, whole = handler.c(regBin.file.content.href, raw=True,
+                                   withHeaders=True)
+        etag = headers['etag']
+        assert(headers['accept-ranges'] == 'bytes')
+        headers, part = handler.c(regBin.file.content.href, raw=True,
+                                  withHeaders=True,
+                                  headers={ 'Range' : 'bytes=5-' })
+        assert(part == whole[5:])
+        assert(headers['content-range'] ==
+                    'bytes 5-%d/%d' % (len(whole) - 1, len(whole)))
+        part = handler.c(regBin.file.content.href, raw=True,
+                         headers={ 'Range' : 'bytes=0-3',
+                                   'If-Range' : etag })
+        assert(part == whole[:4])
+        # a stale If-Range gets everything
+        part = handler.c(regBin.file.content.href, raw=True,
+                         headers={ 'Range' : 'bytes=0-3',
+                                   'If-Range' : '"stale"' })
+        assert(part == whole)
+        handler.e(regBin.file.content.href, raw=True,
+                  headers={ 'Range' : 'bytes=%d-' % len(whole) })
+
+        # clients which can't take gzip get the contents as they are
+        headers, contents = handler.c(regBin.file.content.href, raw=True,
+                                withHeaders=True,
+                                headers={ 'Accept-Encoding' : 'identity' })
+        assert(contents == 'fileContents')
+        assert('content-encoding' not in headers)
+        assert(headers['vary'] == 'Accept-Encoding')
+        contents = handler.c(regBin.file.content.href, raw=True,
+                             headers={ 'Accept-Encoding' : 'gzip;q=0' })
+        assert(contents == 'fileContents')
+        contents = handler.c(regBin.file.content.href, raw=True,
+                             headers={ 'Accept-Encoding' : 'deflate, gzip' },
+                             checkHeaders={ 'content-encoding' : 'gzip' })
+        assert(contents == whole)
+        # browsers list zstd too, but still get the stored bytes and
+        # byte ranges
+        contents = handler.c(regBin.file.content.href, raw=True,
+                             headers={ 'Accept-Encoding' :
+                                            'gzip, deflate, br, zstd' },
+                             checkHeaders={ 'content-encoding' : 'gzip',
+                                            'etag' : etag })
+        assert(contents == whole)
+        part = handler.c(regBin.file.content.href, raw=True,
+                         headers={ 'Accept-Encoding' : 'gzip;q=0.5, zstd',
+                                   'Range' : 'bytes=0-3' })
+        assert(part == whole[:4])
+
         # This file type doesn't have contents (which is why it doesn't have
         # an href attribute
         handler.e('/file/%s/content' % t.trove.fileref[0].fileId)
         handler.e('/file/0101010101010101010101010101010101010101/info')
 
+    def testFileInfoBatch(self):
+        handler = self.makeHandler()
+        trv = self.addComponent(
+                        'foo:runtime=localhost@ns:user1/1.0-1-1',
+                        fileContents = [
+                                ('/etc/link', Symlink(target = 'symtarget')),
+                                ('/etc/regular',
+                                    RegularFile(contents='fileContents')),
+                                ('/etc/socket', Socket()),
+                        ] )
+        t = handler.c('/trove/%s' % self.nvf(trv))
+        link, regular, socket = [ x.fileId for x in t.trove.fileref ]
+        missing = '01' * 20
+
+        resp = handler.c('/file?fileId=%s&fileId=%s&fileId=%s&fileId=%s' %
+                                        (regular, missing, link, socket))
+        assert(resp.fileinfolist.file.sha1 ==
+                        '6446a6956eb3f9780f9c71516a455c14f8237db4')
+        assert(resp.fileinfolist.file.id.endswith('/file/%s/info' % regular))
+        assert(resp.fileinfolist.symlink.target == 'symtarget')
+        assert('socket' in dir(resp.fileinfolist))
+        assert('directory' not in dir(resp.fileinfolist))
+
+        resp = handler.c('/file', data = '%s\n%s,%s\n' % (link, link, socket))
+        assert(resp.fileinfolist.symlink.target == 'symtarget')
+        assert('file' not in dir(resp.fileinfolist))
+
+        # files from troves the user can't see are left out
+        resp = handler.c('/file?fileId=%s' % link, auth = ('user2', 'pw2'))
+        assert('symlink' not in dir(resp.fileinfolist))
+
+        handler.e('/file?fileId=notafileid')
+
+    def testNameCheck(self):
+        self.assertEqual(repquery.nameCheck(None, 'foo:runtime'),
+                         ([ 'item = ?' ], [ 'foo:runtime' ], None))
+        # LIKE is case insensitive on most databases, so the regex has the
+        # final say unless the database is PostgreSQL
+        clauses, args, regex = repquery.nameCheck(None, 'foo_bar.*:.*')
+        self.assertEqual(clauses, [ "item LIKE ? ESCAPE '!'" ])
+        self.assertEqual(args, [ 'foo!_bar%:%' ])
+        assert(regex.match('foo_bar:runtime'))
+        assert(not regex.match('Foo_bar:runtime'))
+
+        class Database:
+            def __init__(self, driver):
+                self.driver = driver
+
+        self.assertEqual(
+                repquery.nameCheck(Database('postgresql'), 'foo_bar.*:.*'),
+                ([ "item LIKE ? ESCAPE '!'" ], [ 'foo!_bar%:%' ], None))
+        self.assertEqual(
+                repquery.nameCheck(Database('sqlite'), 'foo_bar.*:.*'),
+                ([ "item GLOB ?" ], [ 'foo_bar*:*' ], None))
+        clauses, args, regex = repquery.nameCheck(None, 'fo+o:r.*')
+        self.assertEqual(clauses, [ "item LIKE ? ESCAPE '!'" ])
+        self.assertEqual(args, [ 'fo%' ])
+        assert(regex.match('fooo:runtime'))
+        clauses, args, regex = repquery.nameCheck(None, 'foo?:lib')
+        self.assertEqual(args, [ 'fo%' ])
+        clauses, args, regex = repquery.nameCheck(None, 'foo|bar')
+        self.assertEqual(clauses, [])
+
+    def testTypeCheck(self):
+        self.assertEqual(repquery.typeCheck(set()), (None, []))
+        self.assertEqual(repquery.typeCheck(set([ 'bogus' ])), ('1 = 0', []))
+        self.assertEqual(repquery.typeCheck(set([ 'source' ]),
+                                            column = 'Items.item'),
+                         ('((Items.item LIKE ?))', [ '%:source' ]))
+        sql, args = repquery.typeCheck(set([ 'group' ]))
+        self.assertEqual(sql,
+                '((item NOT LIKE ? AND item NOT LIKE ? AND item LIKE ?))')
+        self.assertEqual(args, [ '%:%', 'fileset-%', 'group-%' ])
+        # filesets are collections too
+        self.assertEqual(repquery.typeCheck(set([ 'collection' ])),
+                         ('((item NOT LIKE ?))', [ '%:%' ]))
+
+        # LIKE ignores case in sqlite, but trove.troveIsGroup() doesn't
+        class Database:
+            driver = 'sqlite'
+        sql, args = repquery.typeCheck(set([ 'group' ]), db = Database())
+        self.assertEqual(sql,
+                '((item NOT GLOB ? AND item NOT GLOB ? AND item GLOB ?))')
+        self.assertEqual(args, [ '*:*', 'fileset-*', 'group-*' ])
+
     def testBadConstructor(self):
         self.assertRaises(TypeError,
                           datamodel.BlockDeviceFile, target = 'hello')
@@ -342,6 +660,30 @@ class RestTest(AuthHelper):
         assert(resp.trovelist.total == '6')
         assert(_names(resp) == [ 'fileset-test' ])
 
+        # cursor based paging
+        resp = handler.c(basicQ + '&limit=4&total=0')
+        assert(not hasattr(resp.trovelist, 'total'))
+        assert(_names(resp) == [ 'fileset-test', 'group-hello', 'hello',
+                                 'hello:lib' ])
+        resp = handler.c(resp.trovelist.next)
+        assert(_names(resp) == [ 'hello:runtime', 'hello:source' ])
+        assert(not hasattr(resp.trovelist, 'next'))
+        resp = handler.c(basicQ + '&limit=2&type=component')
+        assert(resp.trovelist.total == '3')
+        resp = handler.c(resp.trovelist.next)
+        assert(resp.trovelist.total == '3')
+        assert(_names(resp) == [ 'hello:source' ])
+        handler.e(basicQ + '&limit=2&cursor=bogus')
+
+        # streamed results are the same as the complete list
+        resp = handler.c(basicQ + '&stream=1')
+        assert(resp.trovelist.total == '6')
+        assert(_names(resp) == [ 'fileset-test', 'group-hello', 'hello',
+                                 'hello:lib', 'hello:runtime', 'hello:source' ])
+        resp = handler.c(basicQ + '&stream=1&start=1&limit=2')
+        assert(resp.trovelist.total == '6')
+        assert(_names(resp) == [ 'group-hello', 'hello' ])
+
         resp = handler.c(basicQ + '&type=group')
         assert(_names(resp) == [ 'group-hello' ])
         resp = handler.c(basicQ + '&type=group&type=fileset')
@@ -355,7 +697,7 @@ class RestTest(AuthHelper):
         resp = handler.c(basicQ + '&type=package')
         assert(_names(resp) == [ 'hello' ])
         resp = handler.c(basicQ + '&type=collection')
-        assert(_names(resp) == [ 'group-hello', 'hello' ])
+        assert(_names(resp) == [ 'fileset-test', 'group-hello', 'hello' ])
 
         resp = handler.c(basicQ + '&type=binarycomponent&latest=0')
         assert(_names(resp) ==
@@ -375,6 +717,18 @@ class RestTest(AuthHelper):
                                  'hello:source'])
         resp = handler.c(basicQ + '&name=h.llo:.*')
         assert(_names(resp) == [ 'hello:lib', 'hello:runtime', 'hello:source'])
+        resp = handler.c(basicQ + '&name=' +
+                         urllib.quote('hello:(lib|runtime)'))
+        assert(_names(resp) == [ 'hello:lib', 'hello:runtime' ])
+        resp = handler.c(basicQ + '&name=.*:lib')
+        assert(_names(resp) == [ 'hello:lib' ])
+
+        # the total doesn't shrink as a regex search is paged through
+        resp = handler.c(basicQ + '&name=h.llo:.*&limit=2')
+        assert(resp.trovelist.total == '3')
+        resp = handler.c(resp.trovelist.next)
+        assert(resp.trovelist.total == '3')
+        assert(_names(resp) == [ 'hello:source' ])
 
         # simple permissions check
         resp = handler.c(basicQ, auth = ('user1', 'pw1'))
@@ -394,6 +748,68 @@ class RestTest(AuthHelper):
                 ['fileset-test', 'group-hello', 'hello', 'hello:lib',
                  'hello:runtime', 'hello:runtime', 'hello:source'])
 
+    def testJSON(self):
+        handler = self.makeHandler()
+        trv = self.addComponent('foo:runtime=1.0[is:x86]')
+        self.addComponent('foo:lib=1.0[is:x86]')
+
+        d = json.loads(handler.c('/trove?format=json', raw = True))
+        assert(d['trovelist']['total'] == 2)
+        assert([ x['name'] for x in d['trovelist']['trove'] ] ==
+                    [ 'foo:lib', 'foo:runtime' ])
+        assert(d['trovelist']['trove'][1]['version']['full'] ==
+                    '/localhost@rpl:linux/1.0-1-1')
+        assert(d['trovelist']['trove'][1]['flavor'] == 'is: x86')
+
+        s = handler.c('/trove', raw = True,
+                      headers = { 'Accept' : 'application/json' },
+                      checkHeaders = { 'content-type' : 'application/json' })
+        assert(json.loads(s) == d)
+        s = handler.c('/trove?format=json&stream=1', raw = True)
+        assert(json.loads(s) == d)
+
+        # xml is still the default
+        resp = handler.c('/trove', headers = {
+                    'Accept' : 'application/xml, application/json;q=0.5' })
+        assert(resp.trovelist.total == '2')
+
+        d = json.loads(handler.c('/trove/%s?format=json' % self.nvf(trv),
+                                 raw = True))
+        assert(d['trove']['name'] == 'foo:runtime')
+        assert(type(d['trove']['fileref']) == list)
+
+        d = json.loads(handler.c('/?format=json', raw = True))
+        assert([ x['name'] for x in d['repository']['label'] ] ==
+                    [ 'localhost@rpl:linux' ])
+
+    def testETag(self):
+        def _status(url, **kwargs):
+            try:
+                handler.c(url, raw = True, **kwargs)
+            except urllib2.HTTPError, e:
+                return e.code
+            return 200
+
+        handler = self.makeHandler()
+        self.addComponent('foo:runtime')
+
+        for url in [ '/', '/trove', '/node' ]:
+            headers, resp = handler.c(url, withHeaders = True)
+            etag = headers['etag']
+            assert(_status(url, headers = { 'If-None-Match' : etag }) == 304)
+            assert(_status(url, headers = { 'If-None-Match' : '"other"' })
+                        == 200)
+            # the representation and the user are part of the tag
+            assert(_status(url + '?format=json',
+                           headers = { 'If-None-Match' : etag }) == 200)
+            assert(_status(url, headers = { 'If-None-Match' : etag },
+                           auth = ('user1', 'pw1')) == 200)
+
+        headers, resp = handler.c('/trove', withHeaders = True)
+        etag = headers['etag']
+        self.addComponent('bar:runtime')
+        assert(_status('/trove', headers = { 'If-None-Match' : etag }) == 200)
+
     def testDistributed(self):
         handler = self.makeHandler()
 
@@ -471,6 +887,46 @@ class RestTest(AuthHelper):
                     '/node?label=localhost@rpl:linux&name=foo:lib&latest=0')
         assert(len(resp.nodelist.node) == 2)
 
+        # paging
+        resp = handler.c('/node?label=localhost@rpl:linux&limit=2')
+        assert(resp.nodelist.total == '3')
+        assert([ x.name for x in resp.nodelist.node ] == [ 'foo', 'foo:lib' ])
+        resp = handler.c(resp.nodelist.next)
+        assert(resp.nodelist.node.name == 'foo:runtime')
+        assert(not hasattr(resp.nodelist, 'next'))
+
+        resp = handler.c('/node?label=localhost@rpl:linux&start=1&limit=1')
+        assert(resp.nodelist.total == '3')
+        assert(resp.nodelist.node.name == 'foo:lib')
+
+        resp = handler.c(
+                '/node?label=localhost@rpl:linux&latest=0&limit=1&total=0')
+        assert(not hasattr(resp.nodelist, 'total'))
+        assert(resp.nodelist.node.name == 'foo')
+        resp = handler.c(resp.nodelist.next)
+        assert(resp.nodelist.node.name == 'foo:lib')
+        assert(resp.nodelist.node.version.revision == '2.0-1-1')
+        resp = handler.c(resp.nodelist.next)
+        assert(resp.nodelist.node.name == 'foo:lib')
+        assert(resp.nodelist.node.version.revision == '1.0-1-1')
+        handler.e('/node?label=localhost@rpl:linux&limit=1&cursor=bogus')
+
+        resp = handler.c('/node?label=localhost@rpl:linux&stream=1')
+        assert(resp.nodelist.total == '3')
+        assert([ x.name for x in resp.nodelist.node ] ==
+                    [ 'foo', 'foo:lib', 'foo:runtime' ])
+
+        # binaries and their source share the source node's changelog;
+        # the lookup is read only, so repeating it gives the same answer
+        self.addComponent('foo:source=2.0')
+        for i in range(2):
+            resp = handler.c('/node?label=localhost@rpl:linux&latest=0')
+            nodes = dict(((x.name, x.version.revision), x)
+                         for x in resp.nodelist.node)
+            source = nodes[('foo:source', '2.0-1')]
+            assert(hasattr(nodes[('foo:lib', '2.0-1-1')], 'changeLog') ==
+                   hasattr(source, 'changeLog'))
+
     def testMetadata(self):
         repos = self.openRepository(0)
         handler = self.makeHandler()
@@ -548,10 +1004,20 @@ class RestTest(AuthHelper):
 
         gzipped = handler.c(resp.trovelist.trove.buildlog.id, raw = True)
         assert(util.decompressString(gzipped) == "text log")
+        # the second time comes from the transcoded log cache
+        gzipped = handler.c(resp.trovelist.trove.buildlog.id, raw = True,
+                            checkHeaders = { 'content-encoding' : 'gzip' })
+        assert(util.decompressString(gzipped) == "text log")
 
         gzipped = handler.c(resp.trovelist.trove.xmlbuildlog.id, raw = True)
         assert(util.decompressString(gzipped) == "xml log")
 
+        headers, log = handler.c(resp.trovelist.trove.buildlog.id, raw = True,
+                                 withHeaders = True,
+                                 headers = { 'Accept-Encoding' : 'identity' })
+        assert(log == "text log")
+        assert('content-encoding' not in headers)
+
     def testContainer(self):
         cmp = self.addRPMComponent("simple:rpm=1.0", 'simple-1.0-1.i386.rpm')
         handler = self.makeHandler()
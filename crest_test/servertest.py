@@ -0,0 +1,86 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os, signal, time, urllib2
+
+from testrunner import testhelp
+
+from crest import server
+
+class PidHandler:
+
+    # answers every request with the pid of the worker which served it
+    def handle(self, req, path):
+        body = str(os.getpid())
+        req.send_response(200)
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        req.wfile.write(body)
+
+class ServerTest(testhelp.TestCase):
+
+    def _start(self, **kwargs):
+        sock = server.listen(('127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:%d/api/' % sock.getsockname()[1]
+        s = server.PreforkServer(PidHandler, sock = sock, prefix = '/api/',
+                                 **kwargs)
+        s.pollInterval = 0.05
+        pid = os.fork()
+        if not pid:
+            try:
+                s.serve()
+            finally:
+                os._exit(0)
+
+        sock.close()
+        return pid
+
+    def _get(self, path = ''):
+        return int(urllib2.urlopen(self.url + path).read())
+
+    def _waitForNewWorker(self, oldPid):
+        for i in range(100):
+            pid = self._get()
+            if pid != oldPid:
+                return pid
+            time.sleep(0.05)
+
+        assert(0)
+
+    def testPrefork(self):
+        master = self._start(workers = 1, maxRequests = 2)
+        try:
+            first = self._get()
+            assert(self._get() == first)
+            # the first worker was replaced after two requests
+            second = self._get()
+            assert(second != first)
+
+            try:
+                urllib2.urlopen(self.url[:-4] + 'other')
+            except urllib2.HTTPError, e:
+                assert(e.code == 404)
+            else:
+                assert(0)
+
+            os.kill(master, signal.SIGHUP)
+            self._waitForNewWorker(second)
+        finally:
+            os.kill(master, signal.SIGTERM)
+            pid, status = os.waitpid(master, 0)
+
+        assert(status == 0)
@@ -0,0 +1,33 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from testrunner import testhelp
+
+from crest import sqlutil
+
+class SqlUtilTest(testhelp.TestCase):
+
+    def testBindList(self):
+        assert(sqlutil.bindList([]) == ("NULL", []))
+        assert(sqlutil.bindList([ 5 ]) == ("?", [ 5 ]))
+        assert(sqlutil.bindList([ 5, 6 ]) == ("?,?", [ 5, 6 ]))
+        assert(sqlutil.bindList(x for x in [ 5, 6, 7 ]) ==
+                    ("?,?,?,?", [ 5, 6, 7, 7 ]))
+
+        # role sets of similar sizes share a statement
+        assert(sqlutil.bindList(range(5))[0] == sqlutil.bindList(range(8))[0])
+        assert(sqlutil.bindList(range(9))[0].count('?') == 16)